@@ -9,18 +9,68 @@ from nested_inline.admin import NestedStackedInline, NestedModelAdmin, NestedTab
 from admin_extra_buttons.decorators import button
 from admin_extra_buttons.mixins import ExtraButtonsMixin
 
-from api_backend.models import Shop, Category, ProductInfo, Product, Parameter, ProductParameter, OrderItem, Order
-from api_backend.services import upload_partner_data
-from api_backend.tasks import celery_upload_partner_data
+from api_backend.models import Shop, Category, ProductInfo, Product, Parameter, ProductParameter, OrderItem, Order, \
+    ImportJob, EmailNotification
+from api_backend.caching import invalidate_catalogue
+from api_backend.importer import rebuild_shop_facets, resync_offers
+from api_backend.services import enqueue_import_job
+
+
+class CatalogueAdminMixin:
+    """
+    catalogue changes made in the admin (including inlines and bulk deletion) drop cached catalogue responses,
+    offers depending on the changed objects get their parameters copy and category facets resynced
+    """
+    # ProductInfo lookup of the offers depending on the objects and the form fields they depend on
+    offers_lookup = None
+    offers_fields = ()
+
+    def affected_offers(self, objs):
+        """
+        offer id -> category id of the offers depending on the objects
+        """
+        if not self.offers_lookup:
+            return {}
+        return dict(ProductInfo.objects.filter(**{f'{self.offers_lookup}__in': objs}).
+                    values_list('id', 'product__category_id').distinct())
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_catalogue()
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if formsets or set(self.offers_fields) & set(form.changed_data):
+            # offers of a product moved to another category leave facets of the initial one
+            resync_offers(self.affected_offers([form.instance]), {form.initial.get('category')} - {None})
+        invalidate_catalogue()
+
+    def delete_model(self, request, obj):
+        offers = self.affected_offers([obj])
+        super().delete_model(request, obj)
+        resync_offers(offers)
+        invalidate_catalogue()
+
+    def delete_queryset(self, request, queryset):
+        offers = self.affected_offers(queryset)
+        super().delete_queryset(request, queryset)
+        resync_offers(offers)
+        invalidate_catalogue()
 
 
 @admin.register(Shop)
-class ShopAdmin(ExtraButtonsMixin, admin.ModelAdmin):
+class ShopAdmin(CatalogueAdminMixin, ExtraButtonsMixin, admin.ModelAdmin):
     list_display = ('name', 'url', 'state', 'user')
+    offers_lookup = 'shop'
     list_filter = ('state',)
     search_fields = ('name',)
     list_editable = ('state',)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        if change and 'state' in form.changed_data:
+            rebuild_shop_facets(obj.id)
+
     @button(label='import', permission=lambda request, obj: request.user.type == 'shop')
     def upload(self, request):
         context = self.get_common_context(request, title='Import products')
@@ -28,10 +78,9 @@ class ShopAdmin(ExtraButtonsMixin, admin.ModelAdmin):
             form = UploadForm(request.POST, request.FILES)
 
             if form.is_valid():
-                uploaded_file = request.FILES['docfile'].read()
-                # upload_partner_data(None, uploaded_file, request.user.id)
-                celery_upload_partner_data(None, uploaded_file, request.user.id)
-                messages.success(request, 'Price list successfully update')
+                uploaded_file = request.FILES['docfile']
+                job = enqueue_import_job(request.user.id, file_obj=uploaded_file)
+                messages.success(request, f'Price list update queued (job #{job.id})')
                 return redirect(admin_urlname(context['opts'], 'changelist'))
         else:
             form = UploadForm()
@@ -40,15 +89,16 @@ class ShopAdmin(ExtraButtonsMixin, admin.ModelAdmin):
 
 
 @admin.register(Category)
-class CategoryAdmin(admin.ModelAdmin):
+class CategoryAdmin(CatalogueAdminMixin, admin.ModelAdmin):
     list_display = ('name', 'display_all_shops')
     list_filter = ('name',)
     search_fields = ('name',)
 
 
 @admin.register(Parameter)
-class ParameterAdmin(admin.ModelAdmin):
-    pass
+class ParameterAdmin(CatalogueAdminMixin, admin.ModelAdmin):
+    offers_lookup = 'product_parameters__parameter'
+    offers_fields = ('name',)
 
 
 class ProductParameterInline(NestedTabularInline):
@@ -60,6 +110,8 @@ class ProductInfoInline(NestedStackedInline):
     model = ProductInfo
     extra = 0
     inlines = (ProductParameterInline,)
+    # copy of the product parameters below
+    readonly_fields = ('parameters',)
 
 
 class UploadForm(forms.Form):
@@ -67,12 +119,14 @@ class UploadForm(forms.Form):
 
 
 @admin.register(Product)
-class ProductAdmin(NestedModelAdmin):
+class ProductAdmin(CatalogueAdminMixin, NestedModelAdmin):
     list_display = ('name', 'category')
     list_filter = ('category',)
     search_fields = ('name',)
     save_on_top = True
     inlines = (ProductInfoInline,)
+    offers_lookup = 'product'
+    offers_fields = ('category',)
 
 
 class OrderItemInline(admin.TabularInline):
@@ -87,3 +141,25 @@ class OrderAdmin(admin.ModelAdmin):
     save_on_top = True
     date_hierarchy = 'dt'
     inlines = (OrderItemInline,)
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'state', 'mode', 'url', 'processed', 'created', 'finished')
+    list_filter = ('state',)
+    readonly_fields = ('result', 'error', 'created', 'started', 'finished')
+
+
+@admin.register(EmailNotification)
+class EmailNotificationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'kind', 'recipient', 'order', 'state', 'attempts', 'next_attempt', 'created', 'sent')
+    list_filter = ('state', 'kind')
+    readonly_fields = ('order', 'attempts', 'error', 'created', 'sent')
+    actions = ('requeue',)
+
+    @admin.action(description='Send again')
+    def requeue(self, request, queryset):
+        """
+        dead letters are sent again by the next periodic run
+        """
+        queryset.update(state='queued', attempts=0, next_attempt=None)
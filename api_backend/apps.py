@@ -4,3 +4,6 @@ from django.apps import AppConfig
 class ApiBackendConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api_backend'
+
+    def ready(self):
+        from api_backend import signals  # noqa
@@ -0,0 +1,102 @@
+import hashlib
+import time
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.http import quote_etag
+from rest_framework.relations import Hyperlink
+
+CATALOGUE_VERSION_KEY = 'catalogue:version'
+CATALOGUE_STATS_KEYS = {True: 'catalogue:hits', False: 'catalogue:misses'}
+
+
+def catalogue_version():
+    """
+    current catalogue version, a part of every cached response key and etag;
+    it starts from a timestamp, so a flushed cache never gets back to an already used version
+    """
+    version = cache.get(CATALOGUE_VERSION_KEY)
+    if version is None:
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+        version = cache.get(CATALOGUE_VERSION_KEY)
+    return version
+
+
+def invalidate_catalogue():
+    """
+    drop cached catalogue responses once the current transaction is committed:
+    responses cached under the previous version are never read again and expire by timeout
+    """
+    transaction.on_commit(_bump_catalogue_version)
+
+
+def _bump_catalogue_version():
+    try:
+        cache.incr(CATALOGUE_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOGUE_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def request_fingerprint(request):
+    """
+    hash of scheme, host (links in responses are absolute), path and sorted query
+    """
+    query = urlencode(sorted((key, sorted(values)) for key, values in request.query_params.lists()), doseq=True)
+    url = f'{request.scheme}://{request.get_host()}{request.path}?{query}'
+    return hashlib.md5(url.encode()).hexdigest()
+
+
+def catalogue_cache_key(request):
+    """
+    cached response key: catalogue version and request fingerprint
+    """
+    return f'catalogue:{catalogue_version()}:{request_fingerprint(request)}'
+
+
+def make_etag(request, *versions):
+    """
+    strong etag of the response: request fingerprint, response format and versions of the resources it shows
+    """
+    renderer = getattr(request, 'accepted_renderer', None)
+    parts = (request_fingerprint(request), getattr(renderer, 'format', ''), *versions)
+    return quote_etag(hashlib.md5(':'.join(map(str, parts)).encode()).hexdigest())
+
+
+def catalogue_etag(request, *versions):
+    return make_etag(request, catalogue_version(), *versions)
+
+
+def plain_data(data):
+    """
+    response data to cache: hyperlinks become plain strings,
+    a pickled Hyperlink keeps str() of its object, which costs a query per shop (shop user)
+    """
+    if isinstance(data, dict):
+        return {key: plain_data(value) for key, value in data.items()}
+    if isinstance(data, list):
+        return [plain_data(value) for value in data]
+    if isinstance(data, Hyperlink):
+        return str(data)
+    return data
+
+
+def count_catalogue_lookup(hit):
+    key = CATALOGUE_STATS_KEYS[hit]
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+def catalogue_cache_stats(reset=False):
+    """
+    cached catalogue responses hit rate
+    """
+    hits, misses = (cache.get(key, 0) for key in (CATALOGUE_STATS_KEYS[True], CATALOGUE_STATS_KEYS[False]))
+    if reset:
+        cache.delete_many(CATALOGUE_STATS_KEYS.values())
+    lookups = hits + misses
+    return {'version': catalogue_version(), 'hits': hits, 'misses': misses,
+            'hit_rate': round(hits / lookups, 4) if lookups else 0}
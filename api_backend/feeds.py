@@ -0,0 +1,165 @@
+import hashlib
+import io
+import json
+import tempfile
+from contextlib import contextmanager
+
+import requests
+from yaml import SafeLoader
+from yaml.events import MappingStartEvent, MappingEndEvent, SequenceStartEvent, SequenceEndEvent
+
+YAML, JSONL = 'yaml', 'jsonl'
+
+JSONL_EXTENSIONS = ('.jsonl', '.ndjson')
+JSONL_CONTENT_TYPES = ('application/jsonl', 'application/x-jsonlines', 'application/x-ndjson')
+
+CHUNK_SIZE = 64 * 1024
+SPOOL_MAX_SIZE = 8 * 1024 * 1024
+
+
+class PriceListFeed:
+    """
+    partner price list: shop name and categories are parsed eagerly,
+    goods are yielded one by one while the feed is read
+    """
+
+    def __init__(self, shop, categories, goods):
+        self.shop = shop
+        self.categories = categories or []
+        self.goods = goods
+
+
+def detect_format(name='', content_type=''):
+    """
+    price list format by file name or http content type, yaml by default
+    """
+    content_type = content_type.split(';')[0].strip().lower()
+    if name.lower().endswith(JSONL_EXTENSIONS) or content_type in JSONL_CONTENT_TYPES:
+        return JSONL
+    return YAML
+
+
+def read_yaml_feed(stream):
+    """
+    event based yaml parsing: the document is read from stream in chunks
+    and every goods entry is constructed separately
+    """
+    loader = SafeLoader(stream)
+    loader.get_event()  # stream start
+    loader.get_event()  # document start
+    if not loader.check_event(MappingStartEvent):
+        loader.dispose()
+        raise ValueError('price list must be a mapping')
+    loader.get_event()
+
+    header = {}
+    while not loader.check_event(MappingEndEvent):
+        key = _construct_next(loader)
+        if key == 'goods' and {'shop', 'categories'} <= header.keys():
+            return PriceListFeed(header['shop'], header['categories'], _iter_yaml_goods(loader))
+        header[key] = _construct_next(loader)
+    loader.dispose()
+    # goods came before the header: nothing to stream, the whole list is already built
+    return PriceListFeed(header.get('shop'), header.get('categories'), iter(header.get('goods') or []))
+
+
+def _construct_next(loader):
+    return loader.construct_document(loader.compose_node(None, None))
+
+
+def _iter_yaml_goods(loader):
+    try:
+        if not loader.check_event(SequenceStartEvent):
+            yield from _construct_next(loader) or []
+            return
+        loader.get_event()
+        while not loader.check_event(SequenceEndEvent):
+            yield _construct_next(loader)
+    finally:
+        loader.dispose()
+
+
+def read_jsonl_feed(lines):
+    """
+    json lines: first line is the header {"shop": ..., "categories": [...]},
+    every next line is one goods entry
+    """
+    lines = (line for line in lines if line.strip())
+    header = json.loads(next(lines, '{}'))
+    return PriceListFeed(header.get('shop'), header.get('categories'), (json.loads(line) for line in lines))
+
+
+class FeedSource:
+    """
+    price list downloaded (or uploaded) to a spooled file with its content digest and http validators
+    """
+
+    def __init__(self, file, feed_format, digest, url=None, etag='', last_modified=''):
+        self.file = file
+        self.format = feed_format
+        self.digest = digest
+        self.url = url
+        self.etag = etag
+        self.last_modified = last_modified
+
+    @property
+    def validators(self):
+        return {'url': self.url, 'etag': self.etag, 'last_modified': self.last_modified, 'digest': self.digest}
+
+    def open(self):
+        """
+        start streaming parse of the price list
+        """
+        return read_jsonl_feed(self.file) if self.format == JSONL else read_yaml_feed(self.file)
+
+
+def _spool(chunks):
+    """
+    copy chunks into a spooled temporary file, returns the file and sha256 of its content
+    """
+    digest = hashlib.sha256()
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+    for chunk in chunks:
+        digest.update(chunk)
+        spool.write(chunk)
+    spool.seek(0)
+    return spool, digest.hexdigest()
+
+
+def _read_chunks(file_obj):
+    if hasattr(file_obj, 'chunks'):
+        yield from file_obj.chunks(CHUNK_SIZE)
+        return
+    while chunk := file_obj.read(CHUNK_SIZE):
+        yield chunk.encode() if isinstance(chunk, str) else chunk
+
+
+@contextmanager
+def fetch_feed(url=None, file_obj=None, etag='', last_modified=''):
+    """
+    get partner price list (file or url); the url request is conditional
+    and None is yielded when the server answers "not modified"
+    """
+    if file_obj:
+        if isinstance(file_obj, (bytes, str)):
+            file_obj = io.BytesIO(file_obj.encode() if isinstance(file_obj, str) else file_obj)
+        spool, digest = _spool(_read_chunks(file_obj))
+        with spool:
+            yield FeedSource(spool, detect_format(getattr(file_obj, 'name', None) or ''), digest)
+        return
+
+    headers = {}
+    if etag:
+        headers['If-None-Match'] = etag
+    if last_modified:
+        headers['If-Modified-Since'] = last_modified
+    with requests.get(url, headers=headers, stream=True) as response:
+        if response.status_code == 304:
+            yield None
+            return
+        response.raise_for_status()
+        spool, digest = _spool(response.iter_content(CHUNK_SIZE))
+        feed_format = detect_format(url, response.headers.get('Content-Type', ''))
+    with spool:
+        yield FeedSource(spool, feed_format, digest, url,
+                         response.headers.get('ETag', ''), response.headers.get('Last-Modified', ''))
@@ -0,0 +1,66 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connections
+from django.db.models import F, Q
+from django_filters import rest_framework as filters
+from rest_framework.filters import SearchFilter
+
+from api_backend.models import ProductInfo, Order, Shop, SEARCH_CONFIG, STATE_CHOICES
+
+
+class ProductInfoFilter(filters.FilterSet):
+    shop_id = filters.NumberFilter(field_name='shop_id')
+    category_id = filters.NumberFilter(field_name='product__category_id')
+    param = filters.CharFilter(method='filter_parameters', label='parameter value as name:value, repeatable')
+
+    class Meta:
+        model = ProductInfo
+        fields = ('shop_id', 'category_id', 'param')
+
+    def filter_parameters(self, queryset, name, value):
+        """
+        ?param=Цвет:черный&param=Встроенная память (Гб):256 -
+        offers having all the parameter values
+        """
+        conditions = {}
+        for condition in self.data.getlist(name):
+            parameter, _, value = condition.partition(':')
+            conditions[parameter.strip()] = value.strip()
+        if connections[queryset.db].vendor == 'postgresql':
+            # containment is served by the GIN index on parameters
+            return queryset.filter(parameters__contains=conditions)
+        return queryset.filter(**{f'parameters__{parameter}': value for parameter, value in conditions.items()})
+
+
+class PartnerOrderFilter(filters.FilterSet):
+    state = filters.MultipleChoiceFilter(choices=[choice for choice in STATE_CHOICES if choice[0] != 'basket'])
+    since = filters.IsoDateTimeFilter(field_name='dt', lookup_expr='gte', label='orders placed since (iso datetime)')
+
+    class Meta:
+        model = Order
+        fields = ('state', 'since')
+
+
+class ProductSearchFilter(SearchFilter):
+    """
+    full text product search on PostgreSQL: every term matches the product name tsvector (GIN index,
+    russian stemming) or the shop name, as SearchFilter does over search_fields; results ranked unless ?ordering=;
+    other databases fall back to `icontains` over view search_fields
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = self.get_search_terms(request)
+        if not terms:
+            return queryset
+        if connections[queryset.db].vendor != 'postgresql':
+            return super().filter_queryset(request, queryset, view)
+
+        conditions = Q()
+        for term in terms:
+            # shops are few: matching shop ids are looked up once and the offers shop index is used
+            conditions &= Q(product__search_vector=SearchQuery(term, config=SEARCH_CONFIG)) | \
+                Q(shop_id__in=Shop.objects.filter(name__icontains=term).values('id'))
+        queryset = queryset.filter(conditions)
+        if request.query_params.get('ordering'):
+            return queryset
+        query = SearchQuery(' '.join(terms), config=SEARCH_CONFIG, search_type='websearch')
+        return queryset.annotate(rank=SearchRank(F('product__search_vector'), query)).order_by('-rank', 'id')
@@ -0,0 +1,43 @@
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.http import QueryDict
+from django.utils import timezone
+
+from api_backend.models import IdempotencyKey
+
+IDEMPOTENCY_KEY_HEADER = 'Idempotency-Key'
+IDEMPOTENCY_KEY_MAX_LENGTH = IdempotencyKey._meta.get_field('key').max_length
+PURGE_BATCH_SIZE = settings.IDEMPOTENCY_KEY_PURGE_BATCH_SIZE
+
+
+def request_fingerprint(request):
+    """
+    sha256 of the request method, path and body data (keys order does not matter)
+    """
+    data = request.data
+    if isinstance(data, QueryDict):
+        data = dict(data.lists())
+    body = json.dumps(data, sort_keys=True, default=str)
+    return hashlib.sha256(f'{request.method}\n{request.path}\n{body}'.encode()).hexdigest()
+
+
+def key_expires():
+    return timezone.now() + timedelta(seconds=settings.IDEMPOTENCY_KEY_TTL)
+
+
+def purge_expired(batch_size=PURGE_BATCH_SIZE):
+    """
+    delete expired keys batch by batch, returns the number of deleted keys
+    """
+    purged = 0
+    while True:
+        batch = list(IdempotencyKey.objects.filter(expires__lte=timezone.now()).
+                     values_list('id', flat=True)[:batch_size])
+        if batch:
+            IdempotencyKey.objects.filter(id__in=batch).delete()
+        purged += len(batch)
+        if len(batch) < batch_size:
+            return purged
@@ -0,0 +1,376 @@
+import logging
+import time
+import zlib
+from decimal import Decimal
+from itertools import islice
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+
+from api_backend.caching import invalidate_catalogue
+from api_backend.models import Shop, Category, ProductInfo, Product, Parameter, ProductParameter, ProductFacet, \
+    SYNC, REPLACE
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = settings.PRICE_LIST_BATCH_SIZE
+SHARDS = settings.PRICE_LIST_SHARDS
+SHARD_SIZE = settings.PRICE_LIST_SHARD_SIZE
+
+OFFER_FIELDS = ('product_id', 'price', 'price_rrc', 'quantity', 'parameters')
+
+
+def rebuild_facets(category_ids):
+    """
+    recount parameter values of the categories over offers of the shops accepting orders (as listed);
+    category rows are locked, so concurrent imports touching the same categories rebuild them one after another
+    """
+    category_ids = sorted(category_ids)
+    if not category_ids:
+        return
+    with transaction.atomic():
+        list(Category.objects.select_for_update().filter(id__in=category_ids).order_by('id').values_list('id'))
+        ProductFacet.objects.filter(category_id__in=category_ids).delete()
+        ProductFacet.objects.bulk_create([
+            ProductFacet(category_id=row['product_info__product__category_id'], parameter_id=row['parameter_id'],
+                         value=row['value'], count=row['count'])
+            for row in ProductParameter.objects.filter(product_info__product__category_id__in=category_ids,
+                                                       product_info__shop__state=True).
+            values('product_info__product__category_id', 'parameter_id', 'value').annotate(count=Count('id')).
+            order_by()
+        ], batch_size=BATCH_SIZE)
+
+
+def rebuild_shop_facets(shop_id):
+    """
+    recount facets of the categories with the shop offers (shop state switched)
+    """
+    rebuild_facets(ProductInfo.objects.filter(shop_id=shop_id).values_list('product__category_id', flat=True).
+                   distinct())
+
+
+def rebuild_offer_parameters(offer_ids):
+    """
+    rewrite the parameters copy of the offers from their product parameters (offers edited in the admin)
+    """
+    parameters = {offer_id: {} for offer_id in offer_ids}
+    for offer_id, name, value in ProductParameter.objects.filter(product_info_id__in=parameters). \
+            values_list('product_info_id', 'parameter__name', 'value'):
+        parameters[offer_id][name] = value
+    ProductInfo.objects.bulk_update([ProductInfo(id=offer_id, parameters=offer_parameters)
+                                     for offer_id, offer_parameters in parameters.items()],
+                                    ('parameters',), batch_size=BATCH_SIZE)
+
+
+def resync_offers(offers, category_ids=()):
+    """
+    offer id -> category id of offers changed outside the importer:
+    their parameters copy is rewritten and facets of their categories recounted
+    """
+    rebuild_offer_parameters(offers)
+    rebuild_facets(set(offers.values()) | set(category_ids))
+
+
+def chunked(iterable, size):
+    """
+    split iterable into lists of at most size items
+    """
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class ImportResolver:
+    """
+    import scoped caches: category ids, parameter name -> id and (product name, category id) -> id;
+    pre-warmed with one query each and kept coherent with rows created during the import
+    """
+
+    def __init__(self):
+        self.categories = set()
+        self.parameters = {}
+        self.products = {}
+        self.stats = {kind: {'hits': 0, 'misses': 0} for kind in ('categories', 'parameters', 'products')}
+
+    def warm(self, category_ids):
+        self.categories = set(Category.objects.values_list('id', flat=True))
+        self.parameters = dict(Parameter.objects.values_list('name', 'id'))
+        self.products = {(name, category_id): product_id for name, category_id, product_id in
+                         Product.objects.filter(category_id__in=category_ids).values_list('name', 'category_id', 'id')}
+
+    def _count(self, kind, keys, cache):
+        """
+        hits and misses of the distinct keys of one lookup
+        """
+        keys = set(keys)
+        hits = sum(1 for key in keys if key in cache)
+        self.stats[kind]['hits'] += hits
+        self.stats[kind]['misses'] += len(keys) - hits
+
+    def resolve_categories(self, categories):
+        """
+        missing categories are created with the feed ids
+        """
+        self._count('categories', [category['id'] for category in categories], self.categories)
+        missing = [category for category in categories if category['id'] not in self.categories]
+        if missing:
+            existing = set(Category.objects.filter(id__in=[category['id'] for category in missing]).
+                           values_list('id', flat=True))
+            Category.objects.bulk_create([Category(id=category['id'], name=category['name'])
+                                          for category in missing if category['id'] not in existing])
+            self.categories.update(category['id'] for category in missing)
+
+    def resolve_products(self, items):
+        """
+        (name, category id) -> product id, missing products are created
+        """
+        keys = [(item['name'], item['category']) for item in items]
+        self._count('products', keys, self.products)
+        missing = set(keys) - self.products.keys()
+        if missing:
+            self.products.update(
+                ((name, category_id), product_id) for name, category_id, product_id in
+                Product.objects.filter(name__in={name for name, _ in missing}).
+                values_list('name', 'category_id', 'id') if (name, category_id) in missing)
+            created = Product.objects.bulk_create([Product(name=name, category_id=category_id)
+                                                   for name, category_id in missing - self.products.keys()])
+            self.products.update(((product.name, product.category_id), product.id) for product in created)
+        return self.products
+
+    def resolve_parameters(self, items):
+        """
+        parameter name -> parameter id, missing parameters are created
+        """
+        names = [name for item in items for name in item['parameters']]
+        self._count('parameters', names, self.parameters)
+        missing = set(names) - self.parameters.keys()
+        if missing:
+            Parameter.objects.bulk_create([Parameter(name=name) for name in missing], ignore_conflicts=True)
+            self.parameters.update(Parameter.objects.filter(name__in=missing).values_list('name', 'id'))
+        return self.parameters
+
+
+class PriceListImporter:
+    """
+    set-based partner price list import:
+    categories, products and parameters are resolved with a few batched lookups per chunk,
+    offers are keyed on (shop, external id) and only inserted, changed or removed ones are written
+    """
+
+    COUNTERS = ('offers', 'inserted', 'updated', 'unchanged', 'removed', 'product_parameters')
+
+    def __init__(self, user_id=0, mode=SYNC, batch_size=BATCH_SIZE, on_progress=None):
+        self.user_id = user_id
+        self.mode = mode
+        self.batch_size = batch_size
+        self.on_progress = on_progress
+        self.shop = None
+        self.offers = {}
+        self.seen = set()
+        self.touched_categories = set()
+        self.resolver = ImportResolver()
+        self.counters = dict.fromkeys(self.COUNTERS, 0)
+
+    def run(self, feed):
+        """
+        refresh shop price list in one transaction, returns import report;
+        goods are consumed from the feed chunk by chunk
+        """
+        started = time.perf_counter()
+        with transaction.atomic():
+            shop = self.prepare(feed)
+            if self.mode == SYNC:
+                self.offers = self.load_offers(shop)
+            for chunk in chunked(feed.goods, self.batch_size):
+                self.import_goods(shop, chunk)
+                if self.on_progress:
+                    self.on_progress(self.counters)
+            self.remove_missing_offers()
+            rebuild_facets(self.touched_categories)
+            invalidate_catalogue()
+        return self.report(shop, time.perf_counter() - started)
+
+    def prepare(self, feed):
+        """
+        shop and its categories, replace mode drops all current shop offers
+        """
+        shop, _ = Shop.objects.get_or_create(name=feed.shop, defaults={'user_id': self.user_id})
+        self.shop = shop
+        self.resolver.warm([category['id'] for category in feed.categories])
+        self.import_categories(shop, feed.categories)
+        if self.mode == REPLACE:
+            offers = ProductInfo.objects.filter(shop_id=shop.id)
+            self.touched_categories.update(offers.values_list('product__category_id', flat=True).distinct())
+            offers.delete()
+        return shop
+
+    def split(self, goods, shards, shard_size):
+        """
+        yield shards of the feed goods (at most shard_size items each);
+        products are hashed to shards so that the same product is never created by two shards
+        """
+        buckets = [[] for _ in range(shards)]
+        for chunk in chunked(goods, self.batch_size):
+            for item in self.unique_items(chunk):
+                number = zlib.crc32(f'{item["name"]}:{item["category"]}'.encode()) % shards
+                buckets[number].append(item)
+                if len(buckets[number]) >= shard_size:
+                    yield buckets[number]
+                    buckets[number] = []
+        yield from (bucket for bucket in buckets if bucket)
+
+    def run_shard(self, shop, items):
+        """
+        import one shard of the feed in its own transaction, offers of other shards are not touched;
+        facets of the touched categories are left to be rebuilt once for the whole feed
+        """
+        started = time.perf_counter()
+        self.shop = shop
+        self.resolver.warm({item['category'] for item in items})
+        with transaction.atomic():
+            if self.mode == SYNC:
+                self.offers = self.load_offers(shop, [item['id'] for item in items])
+            for chunk in chunked(items, self.batch_size):
+                self.import_goods(shop, chunk)
+        return {**self.report(shop, time.perf_counter() - started), 'categories': sorted(self.touched_categories)}
+
+    def missing_offers(self):
+        """
+        after the whole feed was split into shards: shop offers not found in the feed, as offer id -> category id;
+        they are removed once all the shards are imported
+        """
+        if self.mode != SYNC:
+            return {}
+        return {pk: category_id for external_id, pk, category_id in ProductInfo.objects.filter(shop_id=self.shop.id).
+                values_list('external_id', 'id', 'product__category_id') if external_id not in self.seen}
+
+    def report(self, shop, elapsed):
+        result = {
+            'shop': shop.name,
+            'mode': self.mode,
+            'not_modified': False,
+            **self.counters,
+            'cache': self.resolver.stats,
+            'elapsed': round(elapsed, 3),
+            'rows_per_sec': round(self.counters['offers'] / elapsed) if elapsed else self.counters['offers'],
+        }
+        logger.info('price list import %s', result)
+        return result
+
+    @staticmethod
+    def load_offers(shop, external_ids=None):
+        """
+        current shop state: external id -> offer fields
+        """
+        offers = ProductInfo.objects.filter(shop_id=shop.id)
+        if external_ids is not None:
+            offers = offers.filter(external_id__in=external_ids)
+        return {offer['external_id']: offer for offer in offers.values(
+            'id', 'external_id', 'product__category_id', *OFFER_FIELDS)}
+
+    def import_categories(self, shop, categories):
+        self.resolver.resolve_categories(categories)
+        shop.categories.add(*[category['id'] for category in categories])
+
+    def import_goods(self, shop, items):
+        items = self.unique_items(items)
+        products = self.resolver.resolve_products(items)
+        parameters = self.resolver.resolve_parameters(items)
+
+        created, changed, matched = [], [], []
+        for item in items:
+            offer = ProductInfo(product_id=products[(item['name'], item['category'])],
+                                external_id=item['id'],
+                                price=Decimal(str(item['price'])),
+                                price_rrc=Decimal(str(item['price_rrc'])),
+                                quantity=item['quantity'],
+                                parameters={name: str(value) for name, value in item['parameters'].items()},
+                                shop_id=shop.id)
+            current = self.offers.get(offer.external_id)
+            if current is None:
+                created.append((item, offer))
+                self.touched_categories.add(item['category'])
+                continue
+            offer.id = current['id']
+            matched.append((item, offer))
+            if any(getattr(offer, field) != current[field] for field in OFFER_FIELDS):
+                changed.append(offer)
+                self.touched_categories.update((item['category'], current['product__category_id']))
+
+        ProductInfo.objects.bulk_create([offer for _, offer in created], batch_size=self.batch_size)
+        ProductInfo.objects.bulk_update(changed, OFFER_FIELDS, batch_size=self.batch_size)
+
+        product_parameters = [
+            ProductParameter(product_info_id=offer.id, parameter_id=parameters[name], value=value)
+            for item, offer in created
+            for name, value in item['parameters'].items()
+        ]
+        parameters_changed = self.sync_parameters(matched, parameters, product_parameters)
+        ProductParameter.objects.bulk_create(product_parameters, batch_size=self.batch_size)
+
+        updated = {offer.id for offer in changed} | parameters_changed
+        self.counters['offers'] += len(items)
+        self.counters['inserted'] += len(created)
+        self.counters['updated'] += len(updated)
+        self.counters['unchanged'] += len(matched) - len(updated)
+        self.counters['product_parameters'] += len(product_parameters)
+
+    def unique_items(self, items):
+        """
+        skip offers already imported from this feed (duplicated external id)
+        """
+        unique = []
+        for item in items:
+            if item['id'] not in self.seen:
+                self.seen.add(item['id'])
+                unique.append(item)
+        return unique
+
+    def sync_parameters(self, matched, parameters, created):
+        """
+        diff parameters of already existing offers, returns ids of offers with changed parameters;
+        new parameter rows are appended to created
+        """
+        if not matched:
+            return set()
+        current = {(product_info_id, parameter_id): (pk, value) for pk, product_info_id, parameter_id, value in
+                   ProductParameter.objects.filter(product_info_id__in=[offer.id for _, offer in matched]).
+                   values_list('id', 'product_info_id', 'parameter_id', 'value')}
+
+        changed_offers, changed, kept = set(), [], set()
+        for item, offer in matched:
+            for name, value in item['parameters'].items():
+                key = (offer.id, parameters[name])
+                value = str(value)
+                kept.add(key)
+                if key not in current:
+                    created.append(ProductParameter(product_info_id=offer.id, parameter_id=key[1], value=value))
+                    changed_offers.add(offer.id)
+                elif current[key][1] != value:
+                    changed.append(ProductParameter(id=current[key][0], value=value))
+                    changed_offers.add(offer.id)
+
+        removed = [(pk, key[0]) for key, (pk, _) in current.items() if key not in kept]
+        if removed:
+            ProductParameter.objects.filter(id__in=[pk for pk, _ in removed]).delete()
+            changed_offers.update(product_info_id for _, product_info_id in removed)
+        ProductParameter.objects.bulk_update(changed, ('value',), batch_size=self.batch_size)
+        return changed_offers
+
+    def remove_missing_offers(self):
+        """
+        delete offers which are no longer present in the feed
+        """
+        return self.remove_offers({offer['id']: offer['product__category_id']
+                                   for external_id, offer in self.offers.items() if external_id not in self.seen})
+
+    def remove_offers(self, offers):
+        """
+        delete offers given as offer id -> category id, returns the number of removed offers
+        """
+        self.touched_categories.update(offers.values())
+        for chunk in chunked(list(offers), self.batch_size):
+            ProductInfo.objects.filter(id__in=chunk).delete()
+        self.counters['removed'] = len(offers)
+        return self.counters['removed']
@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from api_backend.caching import catalogue_cache_stats, invalidate_catalogue
+
+
+class Command(BaseCommand):
+    help = 'catalogue response cache hit rate'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='reset hit and miss counters')
+        parser.add_argument('--invalidate', action='store_true', help='drop cached responses')
+
+    def handle(self, *args, **options):
+        stats = catalogue_cache_stats(reset=options['reset'])
+        self.stdout.write('version: {version}\nhits: {hits}\nmisses: {misses}\n'
+                          'hit rate: {hit_rate:.2%}'.format(**stats))
+        if options['invalidate']:
+            invalidate_catalogue()
+            self.stdout.write('cached responses invalidated')
@@ -0,0 +1,90 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.serializers import BaseSerializer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api_auth.models import User
+from api_backend.mixins import clear_presenter_fields
+from api_backend.models import Order
+from api_backend.serializers import ProductInfoSerializer, ProductInfoFastSerializer, OrderSerializer, \
+    OrderFastSerializer
+from api_backend.views import ProductInfoViewSet, OrderViewSet
+
+
+class Command(BaseCommand):
+    help = 'per item serialization cost of products and orders listings (hyperlinked and fast serializers) ' \
+           'and nested serializers setup cost'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=200, help='number of listed items')
+        parser.add_argument('--repeat', type=int, default=5, help='best of the repeated runs is reported')
+        parser.add_argument('--user', help='orders owner email, owner of the latest order by default')
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/', HTTP_HOST='localhost'))
+        request.user = self.orders_owner(options['user'])
+        context = {'request': request}
+
+        products = ProductInfoViewSet(request=request, format_kwarg=None).get_queryset()[:options['items']]
+        orders = OrderViewSet(request=request, format_kwarg=None).get_queryset()[:options['items']]
+        for name, queryset, serializers in (
+                ('products', products, (ProductInfoSerializer, ProductInfoFastSerializer)),
+                ('orders', orders, (OrderSerializer, OrderFastSerializer))):
+            # rows are loaded once: only serialization is measured
+            items = list(queryset)
+            if not items:
+                self.stdout.write(f'{name}: no items')
+                continue
+            results = [self.measure(serializer, items, context, options['repeat']) for serializer in serializers]
+            (slow, slow_data), (fast, fast_data) = results
+            self.stdout.write(
+                f'{name}: {len(items)} items, {slow * 1e6 / len(items):.1f} -> {fast * 1e6 / len(items):.1f} us/item, '
+                f'x{slow / fast:.1f}, same output: {slow_data == fast_data}')
+
+        for serializer_class in (ProductInfoSerializer, OrderSerializer):
+            # fields inspected from the models for every serializer vs fields kept by ModelPresenter classes
+            cold = self.measure_setup(serializer_class, context, options['repeat'], clear=True)
+            warm = self.measure_setup(serializer_class, context, options['repeat'], clear=False)
+            self.stdout.write(f'{serializer_class.__name__} setup: {cold * 1e6:.0f} -> {warm * 1e6:.0f} us')
+
+    @staticmethod
+    def measure(serializer_class, items, context, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = serializer_class(items, many=True, context=context).data
+            timings.append(time.perf_counter() - started)
+        return min(timings), json.loads(JSONRenderer().render(data))
+
+    @classmethod
+    def measure_setup(cls, serializer_class, context, repeat, clear):
+        timings = []
+        for _ in range(repeat):
+            if clear:
+                clear_presenter_fields()
+            started = time.perf_counter()
+            cls.build_fields(serializer_class([], many=True, context=context))
+            timings.append(time.perf_counter() - started)
+        return min(timings)
+
+    @classmethod
+    def build_fields(cls, serializer):
+        serializer = getattr(serializer, 'child', serializer)
+        for field in serializer.fields.values():
+            field = getattr(field, 'child', field)
+            if isinstance(field, BaseSerializer):
+                cls.build_fields(field)
+
+    @staticmethod
+    def orders_owner(email):
+        if email:
+            try:
+                return User.objects.get(email=email)
+            except User.DoesNotExist:
+                raise CommandError(f'user {email} not found')
+        owner = Order.objects.exclude(state='basket').values('user_id').order_by('-id').first()
+        return User.objects.filter(id=owner['user_id']).first() if owner else User()
@@ -0,0 +1,31 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:21
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_backend', '0010_remove_shop_xurl_alter_shop_user'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopFeed',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('url', models.URLField(blank=True, null=True, verbose_name='url')),
+                ('etag', models.CharField(blank=True, max_length=255, verbose_name='etag')),
+                ('last_modified', models.CharField(blank=True, max_length=64, verbose_name='last modified')),
+                ('digest', models.CharField(max_length=64, verbose_name='content digest')),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('shop', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to='api_backend.shop', verbose_name='shop')),
+            ],
+            options={
+                'verbose_name': 'Price list feed',
+                'verbose_name_plural': 'Price list feeds',
+                'db_table': 'shop_feeds',
+            },
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:23
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_backend', '0012_importjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='importjob',
+            name='shards',
+            field=models.PositiveIntegerField(default=0, verbose_name='shards'),
+        ),
+        migrations.CreateModel(
+            name='ImportShard',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField(verbose_name='number')),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], max_length=10, verbose_name='status')),
+                ('result', models.JSONField(blank=True, null=True, verbose_name='result')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='import_shards', to='api_backend.importjob', verbose_name='import job')),
+            ],
+            options={
+                'verbose_name': 'Import shard',
+                'verbose_name_plural': 'Import shards',
+                'db_table': 'import_shards',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='importshard',
+            constraint=models.UniqueConstraint(fields=('job', 'number'), name='unique_import_shard'),
+        ),
+    ]
@@ -0,0 +1,40 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:26
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+SEARCH_CONFIG = 'russian'
+
+
+def create_search_index(apps, schema_editor):
+    # GIN index and tsvector trigger are PostgreSQL only, other databases fall back to icontains search
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE INDEX products_search_vector_idx ON products USING gin (search_vector)')
+    schema_editor.execute(
+        'CREATE TRIGGER products_search_vector_update BEFORE INSERT OR UPDATE OF name ON products '
+        f'FOR EACH ROW EXECUTE PROCEDURE tsvector_update_trigger(search_vector, \'pg_catalog.{SEARCH_CONFIG}\', name)')
+    schema_editor.execute(f"UPDATE products SET search_vector = to_tsvector('{SEARCH_CONFIG}', name)")
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP TRIGGER IF EXISTS products_search_vector_update ON products')
+    schema_editor.execute('DROP INDEX IF EXISTS products_search_vector_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_backend', '0013_importshard'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
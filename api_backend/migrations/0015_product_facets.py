@@ -0,0 +1,72 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_parameters(apps, schema_editor):
+    ProductInfo = apps.get_model('api_backend', 'ProductInfo')
+    ProductParameter = apps.get_model('api_backend', 'ProductParameter')
+    ProductFacet = apps.get_model('api_backend', 'ProductFacet')
+
+    parameters = {}
+    for product_info_id, name, value in ProductParameter.objects.values_list(
+            'product_info_id', 'parameter__name', 'value').iterator():
+        parameters.setdefault(product_info_id, {})[name] = value
+    ProductInfo.objects.bulk_update([ProductInfo(id=pk, parameters=values) for pk, values in parameters.items()],
+                                    ('parameters',), batch_size=1000)
+
+    ProductFacet.objects.bulk_create([
+        ProductFacet(category_id=row['product_info__product__category_id'], parameter_id=row['parameter_id'],
+                     value=row['value'], count=row['count'])
+        for row in ProductParameter.objects.values('product_info__product__category_id', 'parameter_id', 'value').
+        annotate(count=models.Count('id')).order_by()
+    ], batch_size=1000)
+
+
+def create_parameters_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('CREATE INDEX product_info_parameters_idx ON product_info USING gin (parameters jsonb_path_ops)')
+
+
+def drop_parameters_index(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    schema_editor.execute('DROP INDEX IF EXISTS product_info_parameters_idx')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_backend', '0014_product_search_vector'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productinfo',
+            name='parameters',
+            field=models.JSONField(blank=True, default=dict, verbose_name='parameters'),
+        ),
+        migrations.CreateModel(
+            name='ProductFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('value', models.CharField(max_length=100, verbose_name='value')),
+                ('count', models.PositiveIntegerField(verbose_name='count')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='api_backend.category', verbose_name='category')),
+                ('parameter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='api_backend.parameter', verbose_name='parameter')),
+            ],
+            options={
+                'verbose_name': 'Facet',
+                'verbose_name_plural': 'Facets',
+                'db_table': 'product_facets',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='productfacet',
+            constraint=models.UniqueConstraint(fields=('category', 'parameter', 'value'), name='unique_product_facet'),
+        ),
+        migrations.RunPython(create_parameters_index, drop_parameters_index),
+        migrations.RunPython(fill_parameters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_snapshots(apps, schema_editor):
+    OrderItem = apps.get_model('api_backend', 'OrderItem')
+    ProductInfo = apps.get_model('api_backend', 'ProductInfo')
+
+    product_info = ProductInfo.objects.filter(id=models.OuterRef('product_info_id'))
+    OrderItem.objects.filter(product_info__isnull=False).update(
+        price=models.Subquery(product_info.values('price')),
+        product_name=models.Subquery(product_info.values('product__name')),
+        shop_id=models.Subquery(product_info.values('shop_id')))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_backend', '0016_order_updated'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='orderitem',
+            name='price',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=20, null=True, verbose_name='price'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='product_name',
+            field=models.CharField(blank=True, max_length=80, verbose_name='product name'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='shop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ordered_items', to='api_backend.shop', verbose_name='shop'),
+        ),
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product_info',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ordered_items', to='api_backend.productinfo', verbose_name='prodict info'),
+        ),
+        migrations.RunPython(fill_snapshots, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:43
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_backend', '0020_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EmailNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('order_accepted', 'Order accepted')], max_length=20, verbose_name='kind')),
+                ('recipient', models.EmailField(max_length=254, verbose_name='recipient')),
+                ('state', models.CharField(choices=[('queued', 'Queued'), ('sent', 'Sent')], default='queued', max_length=10, verbose_name='status')),
+                ('error', models.TextField(blank=True, verbose_name='error')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('sent', models.DateTimeField(blank=True, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='api_backend.order', verbose_name='order')),
+            ],
+            options={
+                'verbose_name': 'Email notification',
+                'verbose_name_plural': 'Email notifications',
+                'db_table': 'email_notifications',
+            },
+        ),
+        migrations.AddIndex(
+            model_name='emailnotification',
+            index=models.Index(fields=['state', 'id'], name='notification_state_idx'),
+        ),
+    ]
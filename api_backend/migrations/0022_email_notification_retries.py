@@ -0,0 +1,28 @@
+# Generated by Django 4.0.10 on 2026-10-18 09:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_backend', '0021_email_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='emailnotification',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='attempts'),
+        ),
+        migrations.AddField(
+            model_name='emailnotification',
+            name='next_attempt',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='next attempt'),
+        ),
+        migrations.AlterField(
+            model_name='emailnotification',
+            name='state',
+            field=models.CharField(choices=[('queued', 'Queued'), ('sent', 'Sent'), ('failed', 'Failed')], default='queued', max_length=10, verbose_name='status'),
+        ),
+    ]
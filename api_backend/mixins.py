@@ -1,6 +1,47 @@
+import copy
+from functools import wraps
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
 from django.http import JsonResponse
+from django.utils import timezone
+from django.utils.http import parse_etags
 from django.views import View
-from rest_framework import serializers
+from rest_framework import serializers, status
+from rest_framework.response import Response
+
+from api_backend.caching import catalogue_cache_key, count_catalogue_lookup, catalogue_etag, plain_data
+from api_backend.idempotency import IDEMPOTENCY_KEY_HEADER, IDEMPOTENCY_KEY_MAX_LENGTH, request_fingerprint, \
+    key_expires
+from api_backend.models import IdempotencyKey, ProductInfo
+from api_backend.responses import ResponseBadRequest, ResponseUnprocessable
+
+CACHED_STATUSES = (status.HTTP_200_OK, status.HTTP_404_NOT_FOUND)
+
+
+class PresenterSerializer(serializers.HyperlinkedModelSerializer):
+    """
+    base of ModelPresenter classes: fields built from the model are kept per class
+    and every serializer instance gets a copy instead of inspecting the model again
+    """
+    fields_template = None
+
+    def get_fields(self):
+        cls = type(self)
+        if cls.__dict__.get('fields_template') is None:
+            cls.fields_template = super().get_fields()
+        return copy.deepcopy(cls.fields_template)
+
+
+_presenters = {}
+
+
+def _presenter_key(model, fields, outer_properties):
+    properties = tuple(sorted(
+        (name, (value.__class__, repr(value)) if isinstance(value, serializers.Field) else value)
+        for name, value in outer_properties.items()))
+    return model, tuple(fields), properties
 
 
 def ModelPresenter(model, fields, outer_properties=None):
@@ -12,12 +53,188 @@ def ModelPresenter(model, fields, outer_properties=None):
         class Meta:
             model = model
             fields = fields
+
+    classes are memoised by model, fields and outer properties
     """
+    outer_properties = outer_properties or {}
+    try:
+        key = _presenter_key(model, fields, outer_properties)
+        presenter = _presenters.get(key)
+    except TypeError:  # unhashable outer property
+        key = presenter = None
+    if presenter is None:
+        Meta = type('Meta', (), {'fields': fields, 'model': model})
+        presenter = type(model.__class__.__name__ + 'Presenter', (PresenterSerializer,),
+                         {**outer_properties, 'Meta': Meta})
+        if key is not None:
+            _presenters[key] = presenter
+    return presenter
 
-    class Serializer(serializers.HyperlinkedModelSerializer):
-        pass
 
-    Meta = type('Meta', (), {'fields': fields, 'model': model})
-    outer_properties = outer_properties or {}
-    outer_properties.update({'Meta': Meta})
-    return type(model.__class__.__name__ + 'Presenter', (Serializer,), outer_properties)
+def clear_presenter_fields():
+    """
+    drop fields kept by ModelPresenter classes (serializer setup benchmark)
+    """
+    for presenter in _presenters.values():
+        presenter.fields_template = None
+
+
+def cached_catalogue_response(handler):
+    """
+    catalogue viewset action decorator: response is cached per query
+    until the catalogue version changes (partner import, shop state switch)
+    """
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = catalogue_cache_key(request)
+        cached = cache.get(key)
+        count_catalogue_lookup(hit=cached is not None)
+        if cached is not None:
+            data, code = cached
+            response = Response(data, status=code)
+        else:
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code in CACHED_STATUSES:
+                cache.set(key, (plain_data(response.data), response.status_code),
+                          timeout=settings.CATALOGUE_CACHE_TIMEOUT)
+        response['X-Cache'] = 'HIT' if cached is not None else 'MISS'
+        return response
+
+    return wrapper
+
+
+class CachedResponseMixin:
+    """
+    read only catalogue viewset with cached list and retrieve responses
+    (an own list or retrieve of the viewset is decorated with cached_catalogue_response)
+    """
+
+    def get_etag(self, request):
+        return catalogue_etag(request)
+
+    @cached_catalogue_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @cached_catalogue_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+def shown_offers(data):
+    """
+    offer representations of a products page or a single product response
+    """
+    return data['data'] if 'data' in data else [data]
+
+
+def current_stock(handler):
+    """
+    products viewset action decorator: offers of a cached response get their current available stock by one query;
+    stock changes with every order and basket reservation, so it is kept out of the cache key and the catalogue etag
+    """
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        response = handler(view, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK and response.get('X-Cache') == 'HIT':
+            offers = shown_offers(response.data)
+            stock = {pk: max(quantity - reserved, 0) for pk, quantity, reserved in ProductInfo.objects.filter(
+                id__in=[offer['id'] for offer in offers]).values_list('id', 'quantity', 'reserved')}
+            for offer in offers:
+                offer['stock_quantity'] = str(stock.get(offer['id'], 0))
+        return response
+
+    return wrapper
+
+
+def conditional_response(handler):
+    """
+    viewset action decorator: the view etag is checked before the action runs,
+    "304 not modified" is returned without queries and serialization when it matches If-None-Match;
+    a view without a request etag (get_etag returns None) is checked against get_response_etag after the action,
+    "If-None-Match: *" matches only an existing representation, so it is checked after the action too
+    """
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        etag = view.get_etag(request)
+        if_none_match = parse_etags(request.headers.get('If-None-Match', ''))
+        if etag is not None and etag in if_none_match:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+        response = handler(view, request, *args, **kwargs)
+        if response.status_code == status.HTTP_200_OK:
+            if etag is None:
+                etag = view.get_response_etag(request, response)
+            if etag in if_none_match or '*' in if_none_match:
+                return Response(status=status.HTTP_304_NOT_MODIFIED, headers={'ETag': etag})
+            response['ETag'] = etag
+        return response
+
+    return wrapper
+
+
+class ConditionalGetMixin:
+    """
+    read only viewset with conditional list and retrieve, the viewset defines get_etag(request)
+    (an own list or retrieve of the viewset is decorated with conditional_response)
+    """
+
+    @conditional_response
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
+    @conditional_response
+    def retrieve(self, request, *args, **kwargs):
+        return super().retrieve(request, *args, **kwargs)
+
+
+def idempotent_response(handler):
+    """
+    write action decorator: a request with Idempotency-Key runs once per user and key,
+    its retries get the stored response without running the action again (until IDEMPOTENCY_KEY_TTL)
+    """
+
+    @wraps(handler)
+    def wrapper(view, request, *args, **kwargs):
+        key = request.headers.get(IDEMPOTENCY_KEY_HEADER)
+        if key is None:
+            return handler(view, request, *args, **kwargs)
+        if not key or len(key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            return ResponseBadRequest(
+                message=f'{IDEMPOTENCY_KEY_HEADER} must be 1 to {IDEMPOTENCY_KEY_MAX_LENGTH} characters long')
+        fingerprint = request_fingerprint(request)
+        # the key row is locked while the action runs, so a concurrent retry waits and then gets the response;
+        # the action writes and the stored response are committed (or rolled back) together
+        with transaction.atomic():
+            record, created = IdempotencyKey.objects.select_for_update().get_or_create(
+                user_id=request.user.id, key=key, defaults={'fingerprint': fingerprint, 'expires': key_expires()})
+            if not created and record.expires > timezone.now() and record.status_code is not None:
+                if record.fingerprint != fingerprint:
+                    return ResponseUnprocessable(message=f'{IDEMPOTENCY_KEY_HEADER} is already used by another request')
+                return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+            response = handler(view, request, *args, **kwargs)
+            if response.status_code >= status.HTTP_500_INTERNAL_SERVER_ERROR:
+                # server errors are not replayed, the retry runs the action again
+                record.delete()
+                return response
+            record.fingerprint, record.expires = fingerprint, key_expires()
+            record.status_code, record.response = response.status_code, response.data
+            record.save()
+        return response
+
+    return wrapper
+
+
+class FastSerializerMixin:
+    """
+    viewset read only actions use its fast_serializer_class (settings.FAST_SERIALIZERS switches them off)
+    """
+    fast_serializer_class = None
+    fast_serializer_actions = ('list', 'retrieve')
+
+    def get_serializer_class(self):
+        if self.fast_serializer_class and settings.FAST_SERIALIZERS and self.action in self.fast_serializer_actions:
+            return self.fast_serializer_class
+        return super().get_serializer_class()
@@ -1,3 +1,6 @@
+from django.contrib.postgres.search import SearchVectorField
+from django.core.cache import cache
+from django.core.serializers.json import DjangoJSONEncoder
 from django.core.validators import MinValueValidator
 from django.db import models
 from django.utils.translation import gettext_lazy as _
@@ -16,6 +19,29 @@ STATE_CHOICES = (
     ('canceled', _('Canceled')),
 )
 
+# text search configuration of product names
+SEARCH_CONFIG = 'russian'
+
+SYNC, REPLACE = 'sync', 'replace'
+IMPORT_MODES = (SYNC, REPLACE)
+
+NOTIFICATION_KIND_CHOICES = (
+    ('order_accepted', _('Order accepted')),
+)
+
+NOTIFICATION_STATE_CHOICES = (
+    ('queued', _('Queued')),
+    ('sent', _('Sent')),
+    ('failed', _('Failed')),
+)
+
+IMPORT_JOB_STATE_CHOICES = (
+    ('queued', _('Queued')),
+    ('running', _('Running')),
+    ('done', _('Done')),
+    ('failed', _('Failed')),
+)
+
 
 class Shop(models.Model):
     name = models.CharField(max_length=50, verbose_name=_('shop name'), unique=True)
@@ -40,6 +66,83 @@ class Shop(models.Model):
         return reverse('shop-detail', kwargs={'pk': self.pk})
 
 
+class ShopFeed(models.Model):
+    shop = models.OneToOneField(Shop, verbose_name=_('shop'), related_name='feed', on_delete=models.CASCADE)
+    url = models.URLField(verbose_name='url', null=True, blank=True)
+    etag = models.CharField(verbose_name='etag', max_length=255, blank=True)
+    last_modified = models.CharField(verbose_name='last modified', max_length=64, blank=True)
+    digest = models.CharField(verbose_name=_('content digest'), max_length=64)
+    updated = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = 'shop_feeds'
+        verbose_name = _('Price list feed')
+        verbose_name_plural = _('Price list feeds')
+
+    def __str__(self):
+        return f'{self.shop}: {self.url or self.digest}'
+
+
+class ImportJob(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('user'), related_name='import_jobs',
+                             on_delete=models.CASCADE)
+    url = models.URLField(verbose_name='url', null=True, blank=True)
+    file = models.FileField(verbose_name=_('file'), upload_to='price_lists/', null=True, blank=True)
+    mode = models.CharField(verbose_name=_('import mode'), max_length=10, default=SYNC,
+                            choices=[(mode, mode) for mode in IMPORT_MODES])
+    state = models.CharField(verbose_name=_('status'), choices=IMPORT_JOB_STATE_CHOICES, max_length=10,
+                             default='queued')
+    processed = models.PositiveIntegerField(verbose_name=_('processed offers'), default=0)
+    shards = models.PositiveIntegerField(verbose_name=_('shards'), default=0)
+    result = models.JSONField(verbose_name=_('result'), null=True, blank=True)
+    error = models.TextField(verbose_name=_('error'), blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'import_jobs'
+        verbose_name = _('Import job')
+        verbose_name_plural = _('Import jobs')
+        ordering = ('-created',)
+
+    def __str__(self):
+        return f'{self.user} [ {self.created} ] {self.state}'
+
+    @property
+    def progress_key(self):
+        return f'import-job:{self.id}:progress'
+
+    @property
+    def progress(self):
+        """
+        running import writes progress to the cache: its transaction is not visible until commit
+        """
+        if self.state == 'running':
+            return cache.get(self.progress_key, self.processed)
+        return self.processed
+
+
+class ImportShard(models.Model):
+    job = models.ForeignKey(ImportJob, verbose_name=_('import job'), related_name='import_shards',
+                            on_delete=models.CASCADE)
+    number = models.PositiveIntegerField(verbose_name=_('number'))
+    state = models.CharField(verbose_name=_('status'), choices=IMPORT_JOB_STATE_CHOICES, max_length=10)
+    result = models.JSONField(verbose_name=_('result'), null=True, blank=True)
+    error = models.TextField(verbose_name=_('error'), blank=True)
+
+    class Meta:
+        db_table = 'import_shards'
+        verbose_name = _('Import shard')
+        verbose_name_plural = _('Import shards')
+        constraints = [
+            models.UniqueConstraint(fields=['job', 'number'], name='unique_import_shard'),
+        ]
+
+    def __str__(self):
+        return f'{self.job} #{self.number} {self.state}'
+
+
 class Category(models.Model):
     name = models.CharField(max_length=50, verbose_name='category name')
     shops = models.ManyToManyField(Shop, blank=True, verbose_name='shops', related_name='categories')
@@ -63,6 +166,8 @@ class Product(models.Model):
     name = models.CharField(max_length=80, verbose_name=_('product name'))
     category = models.ForeignKey(Category, verbose_name=_('category'), related_name='products', blank=True,
                                  on_delete=models.CASCADE)
+    # kept up to date by a database trigger on PostgreSQL, see migration 0014
+    search_vector = SearchVectorField(null=True, editable=False)
 
     class Meta:
         db_table = 'products'
@@ -81,10 +186,14 @@ class ProductInfo(models.Model):
     shop = models.ForeignKey(Shop, verbose_name=_('shop'), related_name='product_infos', blank=True,
                              on_delete=models.CASCADE)
     quantity = models.PositiveIntegerField(verbose_name=_('quantity'))
+    # held by basket stock reservations, see StockReservation
+    reserved = models.PositiveIntegerField(verbose_name=_('reserved'), default=0)
     price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name=_('price'),
                                 validators=[MinValueValidator(0)])
     price_rrc = models.DecimalField(max_digits=20, decimal_places=2, verbose_name=_('recommended retail price'),
                                     validators=[MinValueValidator(0)])
+    # parameter name -> value copy of product_parameters for facet filtering (GIN index on PostgreSQL)
+    parameters = models.JSONField(verbose_name=_('parameters'), default=dict, blank=True)
 
     class Meta:
         db_table = 'product_info'
@@ -97,6 +206,10 @@ class ProductInfo(models.Model):
     def __str__(self):
         return f'{self.shop}: {self.product}'
 
+    @property
+    def available(self):
+        return max(self.quantity - self.reserved, 0)
+
 
 class Parameter(models.Model):
     name = models.CharField(max_length=40, verbose_name=_('name'), unique=True)
@@ -129,17 +242,67 @@ class ProductParameter(models.Model):
         return f'{self.parameter} [ {self.product_info} ]'
 
 
+class ProductFacet(models.Model):
+    """
+    number of offers per parameter value in a category, rebuilt by the price list import
+    """
+    category = models.ForeignKey(Category, verbose_name=_('category'), related_name='facets',
+                                 on_delete=models.CASCADE)
+    parameter = models.ForeignKey(Parameter, verbose_name=_('parameter'), related_name='facets',
+                                  on_delete=models.CASCADE)
+    value = models.CharField(verbose_name=_('value'), max_length=100)
+    count = models.PositiveIntegerField(verbose_name=_('count'))
+
+    class Meta:
+        db_table = 'product_facets'
+        verbose_name = _('Facet')
+        verbose_name_plural = _('Facets')
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'parameter', 'value'], name='unique_product_facet'),
+        ]
+
+    def __str__(self):
+        return f'{self.category}: {self.parameter} = {self.value} ({self.count})'
+
+
+class OrderQuerySet(models.QuerySet):
+
+    def with_total(self, name='summa', live=False, **items_filter):
+        """
+        order total by a correlated subquery over its own items: no join fan-out, no DISTINCT;
+        checked out orders are summed up from item price snapshots, a basket (live=True) from current prices;
+        items_filter limits the summed up items (partner shop lines)
+        """
+        price = models.F('product_info__price') if live else models.F('price')
+        total = OrderItem.objects.filter(order_id=models.OuterRef('pk'), **items_filter).values('order_id').annotate(
+            total=models.Sum(models.F('quantity') * price)).values('total')
+        return self.annotate(**{name: models.Subquery(total, output_field=models.DecimalField(max_digits=20,
+                                                                                          decimal_places=2))})
+
+    def with_items(self, **items_filter):
+        """
+        ordered items snapshots with their shops, OrderSerializer needs no catalogue tables;
+        items_filter limits the items
+        """
+        items = OrderItem.objects.filter(**items_filter).select_related('shop')
+        return self.select_related('contact').prefetch_related(models.Prefetch('ordered_items', queryset=items))
+
+
 class Order(models.Model):
     user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('user'),
                              related_name='orders', blank=True,
                              on_delete=models.CASCADE)
     dt = models.DateTimeField(auto_now_add=True)
+    # queryset .update() calls set it explicitly: orders list etag depends on it
+    updated = models.DateTimeField(verbose_name=_('updated'), auto_now=True)
     state = models.CharField(verbose_name=_('status'), choices=STATE_CHOICES, max_length=25)
     contact = models.ForeignKey(Contact, verbose_name='contact',
                                 related_name='orders',
                                 blank=True, null=True,
                                 on_delete=models.CASCADE)
 
+    objects = OrderQuerySet.as_manager()
+
     class Meta:
         verbose_name = _('Order')
         verbose_name_plural = _('Orders')
@@ -147,17 +310,41 @@ class Order(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['user', 'dt'], name='unique_order'),
         ]
+        indexes = [
+            models.Index(fields=['state', 'dt'], name='order_state_dt_idx'),
+        ]
 
     def __str__(self):
         return f'{self.user} [ {self.dt} ]'
 
 
+class OrderItemQuerySet(models.QuerySet):
+
+    def capture_snapshot(self):
+        """
+        copy current product name, price and shop to the items (checkout), one UPDATE
+        """
+        product_info = ProductInfo.objects.filter(id=models.OuterRef('product_info_id'))
+        return self.filter(product_info__isnull=False).update(
+            price=models.Subquery(product_info.values('price')),
+            product_name=models.Subquery(product_info.values('product__name')),
+            shop_id=models.Subquery(product_info.values('shop_id')))
+
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, verbose_name=_('order'), related_name='ordered_items', blank=True,
                               on_delete=models.CASCADE)
+    # price list import may delete the offer: ordered item keeps its snapshot below
     product_info = models.ForeignKey(ProductInfo, verbose_name=_('prodict info'), related_name='ordered_items',
-                                     blank=True, on_delete=models.CASCADE)
+                                     blank=True, null=True, on_delete=models.SET_NULL)
     quantity = models.PositiveIntegerField(verbose_name=_('quantity'))
+    # snapshot taken at checkout
+    product_name = models.CharField(max_length=80, verbose_name=_('product name'), blank=True)
+    price = models.DecimalField(max_digits=20, decimal_places=2, verbose_name=_('price'), null=True, blank=True)
+    shop = models.ForeignKey(Shop, verbose_name=_('shop'), related_name='ordered_items', blank=True, null=True,
+                             on_delete=models.SET_NULL)
+
+    objects = OrderItemQuerySet.as_manager()
 
     class Meta:
         verbose_name = _('Order position')
@@ -165,6 +352,83 @@ class OrderItem(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['order', 'product_info'], name='unique_order_item'),
         ]
+        indexes = [
+            # partner orders: the shop lines and their orders
+            models.Index(fields=['shop', 'order'], name='order_item_shop_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.order} / {self.product_name or self.product_info} / {self.quantity}'
+
+
+class StockReservation(models.Model):
+    """
+    basket line hold on product stock until it expires; ProductInfo.reserved is the sum of the holds
+    """
+    product_info = models.ForeignKey(ProductInfo, verbose_name=_('product info'), related_name='reservations',
+                                     on_delete=models.CASCADE)
+    # a deleted basket line keeps its hold until the sweeper releases it
+    order_item = models.ForeignKey(OrderItem, verbose_name=_('order item'), related_name='reservations',
+                                   blank=True, null=True, on_delete=models.SET_NULL)
+    quantity = models.PositiveIntegerField(verbose_name=_('quantity'))
+    expires = models.DateTimeField(verbose_name=_('expires'), db_index=True)
+
+    class Meta:
+        db_table = 'stock_reservations'
+        verbose_name = _('Stock reservation')
+        verbose_name_plural = _('Stock reservations')
+
+    def __str__(self):
+        return f'{self.product_info} x {self.quantity} until {self.expires}'
+
+
+class IdempotencyKey(models.Model):
+    """
+    client Idempotency-Key of a write request with the request fingerprint and the response to replay
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, verbose_name=_('user'), related_name='idempotency_keys',
+                             on_delete=models.CASCADE)
+    key = models.CharField(verbose_name=_('key'), max_length=255)
+    fingerprint = models.CharField(verbose_name=_('request fingerprint'), max_length=64)
+    status_code = models.PositiveSmallIntegerField(verbose_name=_('status code'), null=True)
+    response = models.JSONField(verbose_name=_('response'), null=True, encoder=DjangoJSONEncoder)
+    expires = models.DateTimeField(verbose_name=_('expires'), db_index=True)
+
+    class Meta:
+        db_table = 'idempotency_keys'
+        verbose_name = _('Idempotency key')
+        verbose_name_plural = _('Idempotency keys')
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'key'], name='unique_idempotency_key'),
+        ]
+
+    def __str__(self):
+        return f'{self.user}: {self.key}'
+
+
+class EmailNotification(models.Model):
+    """
+    outgoing email queue: notifications are rendered and sent in batches over one mail server connection,
+    failed sends are retried with backoff, "failed" notifications are the dead letters
+    """
+    kind = models.CharField(verbose_name=_('kind'), choices=NOTIFICATION_KIND_CHOICES, max_length=20)
+    order = models.ForeignKey(Order, verbose_name=_('order'), related_name='notifications', on_delete=models.CASCADE)
+    recipient = models.EmailField(verbose_name=_('recipient'))
+    state = models.CharField(verbose_name=_('status'), choices=NOTIFICATION_STATE_CHOICES, max_length=10,
+                             default='queued')
+    attempts = models.PositiveSmallIntegerField(verbose_name=_('attempts'), default=0)
+    next_attempt = models.DateTimeField(verbose_name=_('next attempt'), null=True, blank=True)
+    error = models.TextField(verbose_name=_('error'), blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    sent = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = 'email_notifications'
+        verbose_name = _('Email notification')
+        verbose_name_plural = _('Email notifications')
+        indexes = [
+            models.Index(fields=['state', 'id'], name='notification_state_idx'),
+        ]
 
     def __str__(self):
-        return f'{self.order} / {self.product_info} / {self.quantity}'
+        return f'{self.kind} {self.recipient} [ {self.created} ] {self.state}'
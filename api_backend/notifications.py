@@ -0,0 +1,143 @@
+import logging
+from collections import defaultdict
+from datetime import timedelta
+from functools import lru_cache
+from smtplib import SMTPException, SMTPRecipientsRefused, SMTPResponseException, SMTPServerDisconnected
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import Q
+from django.template.loader import get_template
+from django.utils import timezone
+
+from api_backend.models import EmailNotification, OrderItem
+
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE = settings.EMAIL_NOTIFICATION_BATCH_SIZE
+# smtp errors are OSError too, socket errors and timeouts included
+SEND_ERRORS = (SMTPException, OSError)
+
+SUBJECTS = {
+    'order_accepted': 'order on Netology PD-Diplom Portal',
+}
+
+
+@lru_cache(maxsize=None)
+def notification_template(kind):
+    """
+    templates are loaded and compiled once per process
+    """
+    return get_template(f'api_backend/email/{kind}.txt')
+
+
+def queue_order_accepted(order_id, recipient):
+    """
+    queue the order accepted email, inside the checkout transaction it is queued only with the order
+    """
+    return EmailNotification.objects.create(kind='order_accepted', order_id=order_id, recipient=recipient)
+
+
+def render(notifications):
+    """
+    email messages of the notifications, items of all their orders are fetched by one query
+    """
+    items = defaultdict(list)
+    for item in OrderItem.objects.filter(order_id__in={notification.order_id for notification in notifications}). \
+            order_by('id').values('order_id', 'product_name', 'quantity', 'price'):
+        items[item['order_id']].append(item)
+    messages = []
+    for notification in notifications:
+        user = notification.order.user
+        body = notification_template(notification.kind).render({
+            'user_name': f'{user.first_name} {user.last_name}',
+            'order_id': notification.order_id,
+            'items': items[notification.order_id],
+        })
+        messages.append(EmailMessage(subject=SUBJECTS[notification.kind], body=body, to=[notification.recipient]))
+    return messages
+
+
+def is_connection_lost(error):
+    """
+    the mail server is unreachable: socket errors and timeouts or the server disconnected
+    """
+    return isinstance(error, SMTPServerDisconnected) or not isinstance(error, SMTPException)
+
+
+def is_permanent(error):
+    """
+    the message itself is rejected: refused recipients or a 5xx reply
+    """
+    return isinstance(error, SMTPRecipientsRefused) or \
+        isinstance(error, SMTPResponseException) and error.smtp_code >= 500
+
+
+def failure(notification, error, permanent=False):
+    """
+    transient errors are retried after a doubling delay until EMAIL_NOTIFICATION_MAX_ATTEMPTS,
+    permanent and exhausted ones become dead letters
+    """
+    notification.attempts += 1
+    notification.error = f'{type(error).__name__}: {error}'
+    if permanent or notification.attempts >= settings.EMAIL_NOTIFICATION_MAX_ATTEMPTS:
+        notification.state, notification.next_attempt = 'failed', None
+    else:
+        notification.next_attempt = timezone.now() + timedelta(
+            seconds=settings.EMAIL_NOTIFICATION_RETRY_DELAY * 2 ** (notification.attempts - 1))
+    return notification
+
+
+def deliver(connection, notifications):
+    """
+    send the notifications one by one over the open connection, returns the sent and the failed ones;
+    once the mail server is unreachable the rest of the batch fails with the same error
+    """
+    sent, failed = [], []
+    if not notifications:
+        return sent, failed
+    try:
+        connection.open()
+    except SEND_ERRORS as e:
+        return sent, [failure(notification, e) for notification in notifications]
+    for index, (notification, message) in enumerate(zip(notifications, render(notifications))):
+        try:
+            connection.send_messages([message])
+        except SEND_ERRORS as e:
+            if is_connection_lost(e):
+                connection.close()
+                failed.extend(failure(notification, e) for notification in notifications[index:])
+                break
+            failed.append(failure(notification, e, permanent=is_permanent(e)))
+        else:
+            sent.append(notification.id)
+    return sent, failed
+
+
+def send_queued(batch_size=BATCH_SIZE, connection=None):
+    """
+    send due queued notifications batch by batch over one mail server connection, returns the number of sent emails;
+    every batch is locked (skip locked: concurrent senders take other batches) and its results saved in its transaction
+    """
+    connection = connection or get_connection()
+    total = 0
+    try:
+        while True:
+            with transaction.atomic():
+                notifications = list(EmailNotification.objects.select_for_update(skip_locked=True, of=('self',)).
+                                     filter(Q(next_attempt__isnull=True) | Q(next_attempt__lte=timezone.now()),
+                                            state='queued').order_by('id').select_related('order__user').
+                                     only('kind', 'recipient', 'attempts', 'order__user__first_name',
+                                          'order__user__last_name')[:batch_size])
+                sent, failed = deliver(connection, notifications)
+                EmailNotification.objects.filter(id__in=sent).update(state='sent', sent=timezone.now())
+                EmailNotification.objects.bulk_update(failed, ('state', 'attempts', 'next_attempt', 'error'))
+            for notification in failed:
+                logger.warning('notification %s to %s: %s (%s)', notification.id, notification.recipient,
+                               notification.error, notification.state)
+            total += len(sent)
+            if len(notifications) < batch_size:
+                return total
+    finally:
+        connection.close()
@@ -0,0 +1,29 @@
+from django.conf import settings
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination
+
+from api_backend.responses import ResponseOK
+
+
+class KeysetPagination(CursorPagination):
+    """
+    cursor (keyset) pagination: every page is one indexed range query on the view ordering,
+    `id` unless the view defines its own
+    """
+    ordering = 'id'
+    page_size = settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = settings.MAX_PAGE_SIZE
+
+    def get_paginated_response(self, data):
+        return ResponseOK(next=self.get_next_link(), previous=self.get_previous_link(), data=data)
+
+
+class RankedPagination(LimitOffsetPagination):
+    """
+    limit/offset pages for relevance ranked results, which have no stable key for a cursor
+    """
+    default_limit = settings.PAGE_SIZE
+    max_limit = settings.MAX_PAGE_SIZE
+
+    def get_paginated_response(self, data):
+        return ResponseOK(next=self.get_next_link(), previous=self.get_previous_link(), data=data)
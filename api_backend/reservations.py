@@ -0,0 +1,75 @@
+from collections import Counter
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, When, F
+from django.utils import timezone
+
+from api_backend.models import ProductInfo, StockReservation
+
+SWEEP_BATCH_SIZE = settings.STOCK_RESERVATION_SWEEP_BATCH_SIZE
+
+
+def change_reserved(amounts, sign=1):
+    """
+    add (or subtract) product quantities to ProductInfo.reserved in one UPDATE;
+    locks are always taken reservations first, then products in id order (as checkout does)
+    """
+    if amounts:
+        list(ProductInfo.objects.select_for_update().filter(id__in=amounts).order_by('id').values_list('id'))
+        ProductInfo.objects.filter(id__in=amounts).update(reserved=Case(
+            *[When(id=product_info_id, then=F('reserved') + sign * quantity)
+              for product_info_id, quantity in amounts.items()]))
+
+
+def reserve(order_items):
+    """
+    hold stock for basket lines for STOCK_RESERVATION_TTL seconds (no holds when it is 0);
+    the holds are soft: availability is checked before, not by the holding UPDATE
+    """
+    if not settings.STOCK_RESERVATION_TTL:
+        return
+    expires = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    with transaction.atomic():
+        StockReservation.objects.bulk_create([
+            StockReservation(product_info_id=item.product_info_id, order_item_id=item.id, quantity=item.quantity,
+                             expires=expires) for item in order_items])
+        amounts = Counter()
+        for item in order_items:
+            amounts[item.product_info_id] += item.quantity
+        change_reserved(amounts)
+
+
+def release(reservations):
+    """
+    drop the holds and give their quantities back, returns released quantity per product
+    """
+    with transaction.atomic():
+        amounts = Counter()
+        ids = []
+        for pk, product_info_id, quantity in reservations.select_for_update(). \
+                values_list('id', 'product_info_id', 'quantity'):
+            amounts[product_info_id] += quantity
+            ids.append(pk)
+        StockReservation.objects.filter(id__in=ids).delete()
+        change_reserved(amounts, -1)
+    return amounts
+
+
+def release_expired(batch_size=SWEEP_BATCH_SIZE):
+    """
+    release expired holds batch by batch, every batch in its own short transaction;
+    holds locked by a running checkout are skipped and picked up by the next sweep
+    """
+    released = 0
+    while True:
+        with transaction.atomic():
+            batch = list(StockReservation.objects.select_for_update(skip_locked=True).
+                         filter(expires__lte=timezone.now()).order_by('expires').
+                         values_list('id', flat=True)[:batch_size])
+            if batch:
+                release(StockReservation.objects.filter(id__in=batch))
+        released += len(batch)
+        if len(batch) < batch_size:
+            return released
@@ -13,9 +13,17 @@ def ResponseOK(**kwargs):
     return ResponseBase(True, http_status.HTTP_200_OK, **kwargs)
 
 
+def ResponseAccepted(**kwargs):
+    return ResponseBase(True, http_status.HTTP_202_ACCEPTED, **kwargs)
+
+
 def ResponseNotFound(**kwargs):
     return ResponseBase(False, http_status.HTTP_404_NOT_FOUND, **kwargs)
 
 
 def ResponseBadRequest(**kwargs):
     return ResponseBase(False, http_status.HTTP_400_BAD_REQUEST, **kwargs)
+
+
+def ResponseUnprocessable(**kwargs):
+    return ResponseBase(False, http_status.HTTP_422_UNPROCESSABLE_ENTITY, **kwargs)
@@ -1,16 +1,23 @@
+from django.utils.functional import cached_property
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
+from rest_framework.reverse import reverse
 
 from api_auth.models import Contact, User
 
 from api_backend.mixins import ModelPresenter
-from api_backend.models import Shop, Category, ProductInfo, Product, ProductParameter, Order, OrderItem
+from api_backend.models import Shop, Category, ProductInfo, Product, ProductParameter, Order, OrderItem, \
+    ImportJob, IMPORT_MODES, SYNC
 
 
 class UrlSerializer(serializers.Serializer): # noqa
     url = serializers.URLField()
 
 
+class PriceListSerializer(UrlSerializer): # noqa
+    mode = serializers.ChoiceField(choices=IMPORT_MODES, default=SYNC)
+
+
 class StateSerializer(serializers.Serializer): # noqa
     state = serializers.CharField()
 
@@ -20,6 +27,15 @@ class StateSerializer(serializers.Serializer): # noqa
         return value
 
 
+class ImportJobSerializer(serializers.ModelSerializer):
+    processed = serializers.IntegerField(source='progress', read_only=True)
+
+    class Meta:
+        model = ImportJob
+        fields = ('id', 'state', 'mode', 'url', 'processed', 'result', 'error', 'created', 'started', 'finished')
+        read_only_fields = fields
+
+
 class ShopSerializer(serializers.HyperlinkedModelSerializer):
     class Meta:
         model = Shop
@@ -60,7 +76,7 @@ class ProductInfoSerializer(serializers.HyperlinkedModelSerializer):
     product = ProductSerializer(read_only=True)
     product_parameters = ProductParameterSerializer(read_only=True, many=True)
     shop = ShopSerializer(read_only=True)
-    stock_quantity = serializers.CharField(source='quantity')
+    stock_quantity = serializers.CharField(source='available')
     # product_id_for_order = serializers.CharField(source='id')
 
     class Meta:
@@ -79,8 +95,10 @@ class OrderedItemsSerializer(serializers.ModelSerializer):
 
 class OrderSerializer(serializers.HyperlinkedModelSerializer):
     ContactSerializer = ModelPresenter(Contact, ('person', 'phone'))
-    OrderedItemsSerializer = ModelPresenter(OrderItem, ('quantity', 'product_info'),
-                                            {'product_info': ProductInfoSerializer()})
+    ShopSerializer = ModelPresenter(Shop, ('id', 'name', 'api_url'))
+    OrderedItemsSerializer = ModelPresenter(OrderItem, ('product_info', 'product_name', 'shop', 'price', 'quantity'),
+                                            {'product_info': serializers.PrimaryKeyRelatedField(read_only=True),
+                                             'shop': ShopSerializer()})
 
     contact = ContactSerializer(read_only=True)
     ordered_items = OrderedItemsSerializer(read_only=True, many=True)
@@ -107,14 +125,42 @@ class ShowBasketSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('ordered_items', 'total_sum')
 
 
+class AddOrderItemListSerializer(serializers.ListSerializer):
+    """
+    ordered products of the whole list are fetched by one query, then shop state and stock are checked
+    """
+
+    def to_internal_value(self, data):
+        # errors are reported per item, the same way as the item fields errors
+        attrs = super().to_internal_value(data)
+        products = ProductInfo.objects.select_related('shop').in_bulk({item['product_info'] for item in attrs})
+        errors = []
+        for item in attrs:
+            product_info, error = products.get(item['product_info']), {}
+            if product_info is None:
+                error['product_info'] = [f'product {item["product_info"]} not found']
+            elif not product_info.shop.state:
+                error['product_info'] = [f'shop {product_info.shop.name} does not accept orders']
+            elif item['quantity'] > product_info.available:
+                error['quantity'] = [f'only {product_info.available} in stock']
+            else:
+                item['product_info'] = product_info
+            errors.append(error)
+        if any(errors):
+            raise ValidationError(errors)
+        return attrs
+
+
 class AddOrderItemSerializer(serializers.HyperlinkedModelSerializer):
     items = serializers.JSONField(required=False)
-    product_info = serializers.PrimaryKeyRelatedField(
-        queryset=ProductInfo.objects.select_related('shop', 'product').prefetch_related('shop__user').all())
+    # product info is looked up by AddOrderItemListSerializer for all the items at once
+    product_info = serializers.IntegerField(min_value=1)
 
     class Meta:
         model = OrderItem
         fields = ('product_info', 'quantity', 'items',)
+        extra_kwargs = {'quantity': {'min_value': 1}}
+        list_serializer_class = AddOrderItemListSerializer
 
 
 class CreateOrderSerializer(serializers.HyperlinkedModelSerializer):
@@ -129,3 +175,94 @@ class CreateOrderSerializer(serializers.HyperlinkedModelSerializer):
         fields = ('contact',)
         write_only_fields = ('contact',)
         extra_kwargs = {'contact': {'required': True, 'allow_null': False}}
+
+
+class LinkBuilder:
+    """
+    absolute detail urls of the request: every view url is reversed once and then formatted
+    """
+    PK_PLACEHOLDER = '__pk__'
+
+    def __init__(self, request, format=None):  # noqa
+        self.request = request
+        self.format = format
+        self.templates = {}
+
+    def __call__(self, view_name, pk):
+        template = self.templates.get(view_name)
+        if template is None:
+            url = reverse(view_name, kwargs={'pk': self.PK_PLACEHOLDER}, request=self.request, format=self.format)
+            template = self.templates[view_name] = url.split(self.PK_PLACEHOLDER)
+        return f'{template[0]}{pk}{template[1]}'
+
+
+def format_decimal(value):
+    return None if value is None else f'{value:.2f}'
+
+
+class FastSerializer(serializers.BaseSerializer):
+    """
+    read only serializer built on plain attribute access, same output as its hyperlinked counterpart
+    """
+
+    @cached_property
+    def links(self):
+        return LinkBuilder(self.context['request'], self.context.get('format'))
+
+
+class ProductInfoFastSerializer(FastSerializer):
+    """
+    ProductInfoSerializer output, expects shop, product__category and product_parameters__parameter loaded
+    """
+
+    def to_representation(self, info):
+        product, shop = info.product, info.shop
+        category = product.category
+        return {
+            'id': info.id,
+            'product': {
+                'id': product.id,
+                'name': product.name,
+                'category': {'id': category.id, 'name': category.name,
+                             'api_url': self.links('category-detail', category.id)},
+            },
+            'product_parameters': [{'parameter': str(product_parameter.parameter), 'value': product_parameter.value}
+                                   for product_parameter in info.product_parameters.all()],
+            'shop': {'id': shop.id, 'name': shop.name, 'api_url': self.links('shop-detail', shop.id)},
+            'stock_quantity': str(info.available),
+            'price': format_decimal(info.price),
+            'price_rrc': format_decimal(info.price_rrc),
+        }
+
+
+class OrderFastSerializer(FastSerializer):
+    """
+    OrderSerializer output, expects contact and ordered items with their shops loaded
+    """
+    datetime_field = serializers.DateTimeField()
+    phone_field = Contact._meta.get_field('phone')
+
+    def to_representation(self, order):
+        contact = order.contact
+        if contact is not None:
+            phone = contact.phone
+            contact = {'person': contact.person,
+                       'phone': phone if phone is None else self.phone_field.value_to_string(contact)}
+        return {
+            'id': order.id,
+            'state': order.state,
+            'contact': contact,
+            'dt': self.datetime_field.to_representation(order.dt),
+            'summa': format_decimal(order.summa),
+            'ordered_items': [self.item_representation(item) for item in order.ordered_items.all()],
+        }
+
+    def item_representation(self, item):
+        shop = item.shop
+        return {
+            'product_info': item.product_info_id,
+            'product_name': item.product_name,
+            'shop': shop and {'id': shop.id, 'name': shop.name, 'api_url': self.links('shop-detail', shop.id)},
+            'price': format_decimal(item.price),
+            'quantity': item.quantity,
+        }
@@ -1,42 +1,256 @@
-import requests
-from yaml import load as yaml_load, SafeLoader
-from api_backend.models import Shop, Category, ProductInfo, Product, Parameter, ProductParameter
+import logging
+from collections import Counter
+from itertools import islice, chain
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case, When, F
+from django.utils import timezone
+
+from api_backend.caching import invalidate_catalogue
+from api_backend.feeds import fetch_feed
+from api_backend.importer import PriceListImporter, SHARDS, SHARD_SIZE, rebuild_facets
+from api_backend.models import Shop, ShopFeed, ImportJob, ImportShard, Order, OrderItem, ProductInfo, \
+    StockReservation, SYNC
+from api_backend.notifications import queue_order_accepted
 from api_backend.serializers import UrlSerializer
 
+logger = logging.getLogger(__name__)
 
-def upload_partner_data(url=None, file_obj=None, user_id=0):
+
+def upload_partner_data(url=None, file_obj=None, user_id=0, mode=SYNC, on_progress=None, job=None):
     """
-    partner price list update (file or url)
+    partner price list update (file or url),
+    unchanged price list (http 304 or same content digest) is not imported again,
+    price list larger than one shard is imported by parallel shard tasks when run as a job
     """
+    known = ShopFeed.objects.filter(shop__user_id=user_id, url=url).select_related('shop').first() \
+        if url and mode == SYNC else None
+    validators = {'etag': known.etag, 'last_modified': known.last_modified} if known else {}
+
+    with fetch_feed(url, file_obj, **validators) as source:
+        if source is None:
+            return {'shop': known.shop.name, 'not_modified': True}
+
+        feed = source.open()
+        known = ShopFeed.objects.filter(shop__name=feed.shop).first()
+        if mode == SYNC and known and known.digest == source.digest:
+            if source.url:
+                ShopFeed.objects.filter(id=known.id).update(**source.validators)
+            return {'shop': feed.shop, 'not_modified': True}
+
+        importer = PriceListImporter(user_id=user_id, mode=mode, on_progress=on_progress)
+        head = list(islice(feed.goods, SHARD_SIZE + 1))
+        feed.goods = chain(head, feed.goods)
+        if job and len(head) > SHARD_SIZE:
+            return dispatch_import_shards(job, importer, feed, source.validators)
+        result = importer.run(feed)
+    ShopFeed.objects.update_or_create(shop=importer.shop, defaults=source.validators)
+    return result
+
+
+def enqueue_import_job(user_id, url=None, file_obj=None, mode=SYNC):
+    """
+    create price list import job and send it to the worker after commit
+    """
+    job = ImportJob(user_id=user_id, url=url, mode=mode)
     if file_obj:
-        data = yaml_load(file_obj, Loader=SafeLoader)
+        job.file.save(file_obj.name, file_obj, save=False)
+    job.save()
+    transaction.on_commit(lambda: dispatch_import_job(job))
+    return job
+
+
+def dispatch_import_job(job):
+    """
+    send the job to a worker, the broker is tried once for at most TASK_DISPATCH_TIMEOUT seconds:
+    when it is unavailable the job fails instead of staying queued
+    """
+    from api_backend.tasks import celery_upload_partner_data, publish
+
+    try:
+        publish(celery_upload_partner_data, job.id)
+    except Exception as e:
+        logger.exception('price list import job %s dispatch failed', job.id)
+        job.state, job.error, job.finished = 'failed', f'job dispatch failed: {e}', timezone.now()
+        if job.file:
+            job.file.delete(save=False)
+        job.save(update_fields=('state', 'error', 'finished', 'file'))
+
+
+def run_import_job(job_id):
+    """
+    run queued price list import job
+    """
+    job = ImportJob.objects.get(id=job_id)
+    job.state, job.started = 'running', timezone.now()
+    job.save(update_fields=('state', 'started'))
+
+    def on_progress(counters):
+        cache.set(job.progress_key, counters['offers'], timeout=None)
+
+    try:
+        file_obj = job.file.open('rb') if job.file else None
+        result = upload_partner_data(job.url, file_obj, job.user_id, job.mode, on_progress, job)
+    except Exception as e:
+        logger.exception('price list import job %s failed', job.id)
+        job.state, job.error = 'failed', str(e)
     else:
-        stream = requests.get(url).content
-        data = yaml_load(stream, Loader=SafeLoader)
-
-    shop, _ = Shop.objects.get_or_create(name=data.get('shop'), defaults={'user_id': user_id})
-
-    for category in data['categories']:
-        category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-        category_object.shops.add(shop.id)
-        category_object.save()
-
-    ProductInfo.objects.filter(shop_id=shop.id).delete()
-
-    for item in data['goods']:
-        product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-        product_info = ProductInfo.objects.create(product_id=product.id,
-                                                  external_id=item['id'],
-                                                  price=item['price'],
-                                                  price_rrc=item['price_rrc'],
-                                                  quantity=item['quantity'],
-                                                  shop_id=shop.id)
-        for name, value in item['parameters'].items():
-            parameter_object, _ = Parameter.objects.get_or_create(name=name)
-            ProductParameter.objects.create(product_info_id=product_info.id,
-                                            parameter_id=parameter_object.id,
-                                            value=value)
+        job.state, job.result, job.processed = 'done', result, result.get('offers', 0)
+    finally:
+        if job.file:
+            job.file.delete(save=False)
+
+    if job.shards:
+        # the job is completed by its last finished shard
+        job.save(update_fields=('file',))
+        return job
+    cache.delete(job.progress_key)
+    job.finished = timezone.now()
+    job.save()
+    return job
+
+
+def dispatch_import_shards(job, importer, feed, validators):
+    """
+    send price list shards to parallel worker tasks;
+    offers missing from the feed are found once the whole feed was read and removed by the job completion
+    """
+    from api_backend.tasks import celery_import_price_list_shard
+
+    with transaction.atomic():
+        shop = importer.prepare(feed)
+    shards = 0
+    for shards, items in enumerate(importer.split(feed.goods, SHARDS, SHARD_SIZE), 1):
+        celery_import_price_list_shard.delay(job.id, shards, shop.id, items)
+    missing = importer.missing_offers()
+
+    job.shards = shards
+    job.result = {'shop': shop.name, 'shop_id': shop.id, 'mode': importer.mode, 'missing': list(missing.items()),
+                  'cache': importer.resolver.stats, 'categories': sorted(importer.touched_categories),
+                  'feed': validators}
+    ImportJob.objects.filter(id=job.id).update(shards=job.shards, result=job.result)
+    finish_sharded_import_job(job.id)
+    return job.result
+
+
+def run_import_shard(job_id, number, shop_id, items):
+    """
+    import one shard of a sharded price list import job
+    """
+    job = ImportJob.objects.get(id=job_id)
+    shop = Shop.objects.get(id=shop_id)
+    try:
+        result = PriceListImporter(user_id=job.user_id, mode=job.mode).run_shard(shop, items)
+    except Exception as e:
+        logger.exception('price list import job %s shard %s failed', job.id, number)
+        ImportShard.objects.update_or_create(job_id=job.id, number=number,
+                                             defaults={'state': 'failed', 'error': str(e)})
+    else:
+        ImportShard.objects.update_or_create(job_id=job.id, number=number,
+                                             defaults={'state': 'done', 'result': result})
+        cache.add(job.progress_key, 0, timeout=None)
+        cache.incr(job.progress_key, result['offers'])
+    finish_sharded_import_job(job.id)
+
+
+def finish_sharded_import_job(job_id):
+    """
+    complete sharded import job once all its shards are finished: offers missing from the feed are removed
+    and feed metadata is saved only when every shard succeeded, shard reports are summed up
+    """
+    job = ImportJob.objects.get(id=job_id)
+    shards = list(job.import_shards.values_list('state', 'result', 'error'))
+    if not job.shards or len(shards) < job.shards:
+        return
+    errors = [error for state, _, error in shards if state == 'failed']
+    finished = timezone.now()
+    # only one of concurrently finishing shards gets here
+    if not ImportJob.objects.filter(id=job.id, state='running').update(state='failed' if errors else 'done',
+                                                                       finished=finished):
+        return
+
+    result = dict(job.result)
+    shop_id, validators = result.pop('shop_id'), result.pop('feed')
+    missing = dict(result.pop('missing'))
+    categories = set(result.pop('categories'))
+    removed = 0
+    if not errors and missing:
+        # a failed shard leaves the shop offers as they were, the feed is imported again
+        removed = PriceListImporter(mode=result['mode']).remove_offers(missing)
+        categories.update(missing.values())
+    counters = Counter(removed=removed)
+    cache_stats = {kind: Counter(stats) for kind, stats in result.pop('cache').items()}
+    for _, shard_result, _ in shards:
+        shard_result = shard_result or {}
+        categories.update(shard_result.get('categories', ()))
+        counters.update({key: value for key, value in shard_result.items() if key in PriceListImporter.COUNTERS})
+        for kind, stats in shard_result.get('cache', {}).items():
+            cache_stats.setdefault(kind, Counter()).update(stats)
+    elapsed = (finished - job.started).total_seconds()
+    result.update(counters, cache=cache_stats, not_modified=False, shards=job.shards, elapsed=round(elapsed, 3),
+                  rows_per_sec=round(counters['offers'] / elapsed) if elapsed else counters['offers'])
+
+    rebuild_facets(categories)
+    invalidate_catalogue()
+    ImportJob.objects.filter(id=job.id).update(result=result, processed=counters['offers'], error='\n'.join(errors))
+    cache.delete(job.progress_key)
+    if not errors:
+        ShopFeed.objects.update_or_create(shop_id=shop_id, defaults=validators)
+
+
+class CheckoutError(Exception):
+
+    def __init__(self, message, **details):
+        super().__init__(message)
+        self.message = message
+        self.details = details
+
+
+def checkout_basket(user, contact):
+    """
+    turn the user basket into a new order in one transaction: basket, its stock reservations and products rows
+    are locked (products in id order, so concurrent checkouts never deadlock), every line must be in stock
+    besides the stock held by others, stock is decreased and own holds are dropped by one UPDATE
+    (shown stock is invalidated on commit),
+    the ordered items get their price snapshot and the order accepted email is queued
+    """
+    with transaction.atomic():
+        order = Order.objects.select_for_update().filter(user_id=user.id, state='basket').first()
+        lines = list(OrderItem.objects.filter(order_id=order.id).values_list('id', 'product_info_id', 'quantity')) \
+            if order else []
+        if not lines:
+            raise CheckoutError('basket is empty')
+
+        holds = list(StockReservation.objects.select_for_update().filter(order_item__order_id=order.id).
+                     values_list('id', 'product_info_id', 'quantity'))
+        held = Counter()
+        for _, product_info_id, quantity in holds:
+            held[product_info_id] += quantity
+
+        products = ProductInfo.objects.select_for_update(of=('self',)).select_related('shop'). \
+            filter(id__in=[product_info_id for _, product_info_id, _ in lines]).order_by('id').in_bulk()
+        short = []
+        for item_id, product_info_id, quantity in lines:
+            product_info = products.get(product_info_id)
+            in_stock = product_info.quantity - product_info.reserved + held[product_info_id] \
+                if product_info and product_info.shop.state else 0
+            if in_stock < quantity:
+                short.append({'id': item_id, 'product_info': product_info_id, 'quantity': quantity,
+                              'in_stock': max(in_stock, 0)})
+        if short:
+            raise CheckoutError('not enough products in stock', data=short)
+
+        StockReservation.objects.filter(id__in=[pk for pk, _, _ in holds]).delete()
+        ProductInfo.objects.filter(id__in=products).update(
+            quantity=Case(*[When(id=product_info_id, then=F('quantity') - quantity)
+                            for _, product_info_id, quantity in lines]),
+            reserved=Case(*[When(id=product_info_id, then=F('reserved') - quantity)
+                            for product_info_id, quantity in held.items()], default=F('reserved')))
+        Order.objects.filter(id=order.id).update(contact=contact, state='new', updated=timezone.now())
+        OrderItem.objects.filter(order_id=order.id).capture_snapshot()
+        queue_order_accepted(order.id, user.email)
+    return order
 
 
 def validate_url(url):
@@ -0,0 +1,15 @@
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+from django.utils import timezone
+
+from api_auth.models import Contact
+from api_backend.models import Order
+
+
+@receiver(post_save, sender=Contact)
+def touch_contact_orders(sender, instance, created, **kwargs):
+    """
+    orders show their contact: a changed contact changes the orders list etag
+    """
+    if not created:
+        Order.objects.filter(contact_id=instance.id).update(updated=timezone.now())
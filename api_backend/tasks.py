@@ -1,63 +1,73 @@
-from django.core.mail import send_mail
-import requests
-from yaml import load as yaml_load, SafeLoader
+import logging
+
+from django.conf import settings
 
 from core.celery import app
-from api_backend.models import OrderItem, Shop, Category, ProductInfo, Product, Parameter, ProductParameter
+from api_backend.idempotency import purge_expired
+from api_backend.notifications import send_queued
+from api_backend.reservations import release_expired
+from api_backend.services import run_import_job, run_import_shard
+
+logger = logging.getLogger(__name__)
 
 
 @app.task
-def send_mail_order_accepted(order_id: str, user_name: str, user_email: str):
+def send_notifications():
     """
-    send order to buyer email
+    send queued email notifications (after checkout and periodic for the due retries)
     """
-    ordered_items = OrderItem.objects.filter(order__id=order_id). \
-        prefetch_related('product_info', 'order', 'product_info__shop__user').all()
+    return send_queued()
 
-    subject = f'order on Netology PD-Diplom Portal'
-    message = f'Dear {user_name}, your order #{order_id} has been received and accepted for work.\n' \
-              f'Order items:\n'
 
-    for item in ordered_items:
-        order_item = f'{item.product_info.product}:: ' \
-                     f'quantity {item.quantity}:: ' \
-                     f'price {item.product_info.price}\n'
-        message += order_item
+def publish(task, *args):
+    """
+    send the task over its own broker connection: one connection attempt bounded by TASK_DISPATCH_TIMEOUT,
+    no retries (the producer pool connections retry for seconds), raises when the broker is unavailable
+    """
+    with app.connection_for_write(transport_options={'max_retries': 0}) as connection:
+        # the broker_connection_timeout setting takes precedence over the connect_timeout argument
+        connection.connect_timeout = settings.TASK_DISPATCH_TIMEOUT
+        return task.apply_async(args, connection=connection, retry=False)
 
-    return send_mail(subject=subject, message=message, from_email=None, recipient_list=[user_email])
+
+def dispatch_notifications():
+    """
+    hand the queued notifications over to a worker, the broker is tried once:
+    when it is unavailable they are sent by the periodic task
+    """
+    try:
+        publish(send_notifications)
+    except Exception as e:
+        logger.warning('notifications dispatch failed: %s', e)
 
 
 @app.task
-def celery_upload_partner_data(url=None, file_obj=None, user_id=0):
+def celery_upload_partner_data(job_id):
     """
     partner price list update (file or url)
     """
-    if file_obj:
-        data = yaml_load(file_obj, Loader=SafeLoader)
-    else:
-        stream = requests.get(url).content
-        data = yaml_load(stream, Loader=SafeLoader)
-
-    shop, _ = Shop.objects.get_or_create(name=data.get('shop'), defaults={'user_id': user_id})
-
-    for category in data['categories']:
-        category_object, _ = Category.objects.get_or_create(id=category['id'], name=category['name'])
-        category_object.shops.add(shop.id)
-        category_object.save()
-
-    ProductInfo.objects.filter(shop_id=shop.id).delete()
-
-    for item in data['goods']:
-        product, _ = Product.objects.get_or_create(name=item['name'], category_id=item['category'])
-
-        product_info = ProductInfo.objects.create(product_id=product.id,
-                                                  external_id=item['id'],
-                                                  price=item['price'],
-                                                  price_rrc=item['price_rrc'],
-                                                  quantity=item['quantity'],
-                                                  shop_id=shop.id)
-        for name, value in item['parameters'].items():
-            parameter_object, _ = Parameter.objects.get_or_create(name=name)
-            ProductParameter.objects.create(product_info_id=product_info.id,
-                                            parameter_id=parameter_object.id,
-                                            value=value)
+    return run_import_job(job_id).state
+
+
+@app.task
+def celery_import_price_list_shard(job_id, number, shop_id, items):
+    """
+    import one shard of a large partner price list
+    """
+    run_import_shard(job_id, number, shop_id, items)
+
+
+@app.task
+def release_expired_reservations():
+    """
+    release expired basket stock reservations (periodic)
+    """
+    return release_expired()
+
+
+@app.task
+def purge_expired_idempotency_keys():
+    """
+    delete expired idempotency keys (periodic)
+    """
+    return purge_expired()
@@ -1,12 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
 
-from .views import ShopViewSet, CategoryViewSet, ProductInfoViewSet, OrderViewSet, PartnerViewSet, BasketViewSet
+from .views import ShopViewSet, CategoryViewSet, ProductInfoViewSet, OrderViewSet, PartnerViewSet, BasketViewSet, \
+    ImportJobViewSet
 
 router = DefaultRouter()
 router.register('shops', ShopViewSet)
 router.register('categories', CategoryViewSet)
 router.register('product', ProductInfoViewSet)
+router.register('partner/import-jobs', ImportJobViewSet, 'import-jobs')
 router.register('partner', PartnerViewSet, 'partner')
 router.register('basket', BasketViewSet, 'basket')
 router.register('orders', OrderViewSet, 'orders')
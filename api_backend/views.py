@@ -1,22 +1,37 @@
 import json
 
-from django.db import IntegrityError
-from django.db.models import Q, Sum, F, DecimalField
-from rest_framework import viewsets
+from django.db import IntegrityError, transaction
+from django.db.models import Prefetch, Max, Count
+from django_filters.rest_framework import DjangoFilterBackend
+from rest_framework import mixins, viewsets
 from rest_framework.decorators import action
+from rest_framework.filters import OrderingFilter
 from rest_framework.permissions import IsAuthenticated
 
-from api_backend.models import Shop, Category, ProductInfo, Order, OrderItem
-from api_backend.responses import ResponseOK, ResponseNotFound, ResponseBadRequest
+from api_backend.caching import invalidate_catalogue, make_etag, catalogue_etag
+from api_backend.filters import ProductInfoFilter, ProductSearchFilter, PartnerOrderFilter
+from api_backend.importer import rebuild_shop_facets
+from api_backend.mixins import CachedResponseMixin, cached_catalogue_response, ConditionalGetMixin, \
+    conditional_response, FastSerializerMixin, idempotent_response, current_stock, shown_offers
+from api_backend.models import Shop, Category, ProductInfo, Order, OrderItem, ProductParameter, ProductFacet, \
+    StockReservation
+from api_backend.pagination import KeysetPagination, RankedPagination
+from api_backend.reservations import reserve, release
+from api_backend.responses import ResponseOK, ResponseNotFound, ResponseBadRequest, ResponseAccepted
 from api_backend.serializers import ShopDetailSerializer, ShopSerializer, CategorySerializer, \
     CategoryDetailSerializer, ProductInfoSerializer, OrderSerializer, StateSerializer, ShowBasketSerializer, \
-    AddOrderItemSerializer, CreateOrderSerializer
-from api_backend.services import upload_partner_data, validate_url
-from api_backend.tasks import send_mail_order_accepted, celery_upload_partner_data
+    AddOrderItemSerializer, CreateOrderSerializer, PriceListSerializer, ImportJobSerializer, \
+    ProductInfoFastSerializer, OrderFastSerializer
+from api_backend.services import validate_url, enqueue_import_job, checkout_basket, CheckoutError
+from api_backend.tasks import dispatch_notifications
 
 
-class PartnerViewSet(viewsets.ReadOnlyModelViewSet):
+class PartnerViewSet(FastSerializerMixin, viewsets.ReadOnlyModelViewSet):
     permission_classes = [IsAuthenticated]
+    fast_serializer_class = OrderFastSerializer
+    fast_serializer_actions = ('get_orders',)
+    # partner orders
+    filterset_class = PartnerOrderFilter
 
     @action(detail=False, methods=('get', 'put'), url_name='state', url_path='state')
     def state(self, request, *args, **kwargs):
@@ -33,9 +48,12 @@ class PartnerViewSet(viewsets.ReadOnlyModelViewSet):
             serializer.is_valid(raise_exception=True)
             shop = Shop.objects.filter(user_id=request.user.id).first()
             if shop:
-                state = serializer.validated_data.get('state')
-                shop.state = True if state == 'on' else False
-                shop.save()
+                state = serializer.validated_data.get('state') == 'on'
+                if shop.state != state:
+                    shop.state = state
+                    shop.save()
+                    rebuild_shop_facets(shop.id)
+                    invalidate_catalogue()
                 return ResponseOK(shop_state=shop.state)
         return ResponseNotFound(message='shop not found')
 
@@ -46,36 +64,49 @@ class PartnerViewSet(viewsets.ReadOnlyModelViewSet):
         """
         if request.user.type != 'shop':
             return ResponseBadRequest(message='only for shops')
-        url = validate_url(request.data)
-        # upload_partner_data(url, None, request.user.id)
-        celery_upload_partner_data(url, None, request.user.id)
-        return ResponseOK(message='price list successfully update')
+        serializer = PriceListSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        url, mode = serializer.validated_data['url'], serializer.validated_data['mode']
+        job = enqueue_import_job(request.user.id, url=url, mode=mode)
+        return ResponseAccepted(message='price list update queued', job_id=job.id)
 
-    @action(detail=False, methods=('get',), url_name='orders', url_path='orders')
+    @action(detail=False, methods=('get',), url_name='orders', url_path='orders', serializer_class=OrderSerializer,
+            filter_backends=(DjangoFilterBackend,), pagination_class=KeysetPagination)
     def get_orders(self, request, *args, **kwargs):
         """
-        partner orders list
+        orders with the lines of the partner shops only,
+        filtered by ?state=new&state=confirmed and ?since=<iso datetime>, cursor paged
         """
-        url = validate_url(request.data)
-        order = Order.objects.filter(ordered_items__product_info__shop__url=url).exclude(state='basket'). \
-            prefetch_related(
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__shop',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            summa=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'),
-                      output_field=DecimalField(max_digits=20, decimal_places=2))
-        ).distinct()
-        if order:
-            serializer = OrderSerializer(order, many=True, context={'request': request})
-            return ResponseOK(data=serializer.data)
+        if request.user.type != 'shop':
+            return ResponseBadRequest(message='only for shops')
+        shops = list(Shop.objects.filter(user_id=request.user.id).values_list('id', flat=True))
+        shop_orders = OrderItem.objects.filter(shop_id__in=shops).values('order_id')
+        orders = Order.objects.filter(id__in=shop_orders).exclude(state='basket'). \
+            with_items(shop_id__in=shops).with_total(shop_id__in=shops)
+        page = self.paginate_queryset(self.filter_queryset(orders))
+        if page:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer.data)
         return ResponseNotFound(message='no orders')
 
 
-class ShopViewSet(viewsets.ReadOnlyModelViewSet):
+class ImportJobViewSet(viewsets.ReadOnlyModelViewSet):
+    """
+    partner price list import jobs status
+    """
+    permission_classes = (IsAuthenticated,)
+    serializer_class = ImportJobSerializer
+
+    def get_queryset(self):
+        return self.request.user.import_jobs.all()
+
+
+class ShopViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """
     shops list
     """
     queryset = Shop.objects
+    pagination_class = KeysetPagination
     filterset_fields = ('state',)
     ordering_fields = ('name', 'id',)
     search_fields = ('name',)
@@ -91,15 +122,16 @@ class ShopViewSet(viewsets.ReadOnlyModelViewSet):
         return self.serializer_classes.get(self.action, self.default_serializer_class)
 
 
-class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
+class CategoryViewSet(ConditionalGetMixin, CachedResponseMixin, viewsets.ReadOnlyModelViewSet):
     """
     category list
     """
     queryset = Category.objects
+    pagination_class = KeysetPagination
     filterset_fields = ('name',)
     ordering_fields = ('name', 'id',)
     search_fields = ('name',)
-    ordering = ('name',)
+    ordering = ('id',)
 
     serializer_classes = {
         'list': CategorySerializer,
@@ -110,38 +142,78 @@ class CategoryViewSet(viewsets.ReadOnlyModelViewSet):
     def get_serializer_class(self):
         return self.serializer_classes.get(self.action, self.default_serializer_class)
 
+    @action(detail=True, methods=('get',), url_name='facets', url_path='facets')
+    def facets(self, request, *args, **kwargs):
+        """
+        parameter values of the category products with offers count
+        (filter products with /product/?category_id=..&param=name:value)
+        """
+        facets = {}
+        for name, value, count in ProductFacet.objects.filter(category_id=kwargs['pk']). \
+                order_by('parameter__name', '-count', 'value').values_list('parameter__name', 'value', 'count'):
+            facets.setdefault(name, []).append({'value': value, 'count': count})
+        if facets:
+            return ResponseOK(data=[{'parameter': name, 'values': values} for name, values in facets.items()])
+        return ResponseNotFound(message='no facets for category')
+
 
-class ProductInfoViewSet(viewsets.ReadOnlyModelViewSet):
+class ProductInfoViewSet(ConditionalGetMixin, CachedResponseMixin, FastSerializerMixin,
+                         viewsets.ReadOnlyModelViewSet):
     """
     products search
     """
 
     queryset = ProductInfo.objects
+    serializer_class = ProductInfoSerializer
+    fast_serializer_class = ProductInfoFastSerializer
+    pagination_class = KeysetPagination
+    search_pagination_class = RankedPagination
+    # search goes after ordering: ranked results keep their relevance order
+    filter_backends = (DjangoFilterBackend, OrderingFilter, ProductSearchFilter)
+    filterset_class = ProductInfoFilter
     search_fields = ('product__name', 'shop__name',)
+    # explicit: OrderingFilter can not take the fields from the fast serializer
+    ordering_fields = ('id', 'price', 'price_rrc')
+    ordering = ('id',)
 
-    def get_queryset(self):
-        query = Q(shop__state=True)
-        shop_id = self.request.query_params.get('shop_id')
-        category_id = self.request.query_params.get('category_id')
-
-        if shop_id:
-            query = query & Q(shop_id=shop_id)
+    @property
+    def paginator(self):
+        if not hasattr(self, '_paginator'):
+            searching = ProductSearchFilter().get_search_terms(self.request)
+            self._paginator = self.search_pagination_class() if searching else self.pagination_class()
+        return self._paginator
 
-        if category_id:
-            query = query & Q(product__category_id=category_id)
+    def get_etag(self, request):
+        # the shown stock is not versioned: the etag is checked after the action
+        return None
 
-        return ProductInfo.objects. \
-            filter(query). \
-            select_related('shop', 'product__category'). \
-            prefetch_related('product_parameters__parameter').distinct()
+    def get_response_etag(self, request, response):
+        return catalogue_etag(request, [(offer['id'], offer['stock_quantity'])
+                                        for offer in shown_offers(response.data)])
 
+    def get_queryset(self):
+        # shop and product are forward foreign keys: no row fan-out, so no DISTINCT is needed
+        return ProductInfo.objects.filter(shop__state=True). \
+            select_related('shop', 'product__category').defer('product__search_vector'). \
+            prefetch_related(Prefetch('product_parameters',
+                                      queryset=ProductParameter.objects.select_related('parameter')))
+
+    @conditional_response
+    @current_stock
+    @cached_catalogue_response
     def list(self, request, *args, **kwargs):
-        products = self.get_queryset()
+        products = self.paginate_queryset(self.filter_queryset(self.get_queryset()))
         if products:
-            serializer = ProductInfoSerializer(products, many=True, context={'request': request})
-            return ResponseOK(data=serializer.data)
+            serializer = self.get_serializer(products, many=True)
+            return self.get_paginated_response(serializer.data)
         return ResponseNotFound(message='products not found')
 
+    @conditional_response
+    @current_stock
+    @cached_catalogue_response
+    def retrieve(self, request, *args, **kwargs):
+        return mixins.RetrieveModelMixin.retrieve(self, request, *args, **kwargs)
+
 
 class BasketViewSet(viewsets.GenericViewSet):
     """
@@ -158,19 +230,16 @@ class BasketViewSet(viewsets.GenericViewSet):
                 items = json.loads(items_string)
             except (ValueError, TypeError):
                 return False
+            if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+                return False
         else:
             items = [data]
         return items
 
     def get_queryset(self, *argc, **argv):
-        return Order.objects.filter(
-            user_id=self.request.user.id, state='basket').prefetch_related(
-            'ordered_items__product_info__shop',
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').annotate(
-            total_sum=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'),
-                          output_field=DecimalField(max_digits=20, decimal_places=2)
-                          )).distinct()
+        return Order.objects.filter(user_id=self.request.user.id, state='basket'). \
+            prefetch_related(Prefetch('ordered_items', queryset=OrderItem.objects.select_related(
+                'product_info__product', 'product_info__shop'))).with_total('total_sum', live=True)
 
     def list(self, request, *args, **kwargs):
         """
@@ -182,6 +251,7 @@ class BasketViewSet(viewsets.GenericViewSet):
             return ResponseOK(data=serializer.data)
         return ResponseNotFound(message='no products in basket')
 
+    @idempotent_response
     def post(self, request, *args, **kwargs):
         """
         add products to basket
@@ -190,18 +260,16 @@ class BasketViewSet(viewsets.GenericViewSet):
         if not items:
             return ResponseBadRequest(message='invalid request format')
 
-        basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
+        serializer = AddOrderItemSerializer(data=items, many=True)
+        serializer.is_valid(raise_exception=True)
 
-        # todo: подумать как проверить количество заказываемого товара на складе
-        ordered_items = []
-        for order_item in items:
-            serializer = AddOrderItemSerializer(data=order_item)
-            serializer.is_valid(raise_exception=True)
-            data = serializer.validated_data
-            data.update({'order_id': basket.id})
-            ordered_items.append(OrderItem(**data))
+        basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
+        ordered_items = [OrderItem(order_id=basket.id, product_info=data['product_info'], quantity=data['quantity'])
+                         for data in serializer.validated_data]
         try:
-            OrderItem.objects.bulk_create(ordered_items)
+            with transaction.atomic():
+                OrderItem.objects.bulk_create(ordered_items)
+                reserve(ordered_items)
         except IntegrityError:
             return ResponseBadRequest(message='product already in basket')
         return ResponseOK(message='products successfully added to basket', order_id=basket.id)
@@ -214,23 +282,40 @@ class BasketViewSet(viewsets.GenericViewSet):
         if not items:
             return ResponseBadRequest(message='invalid request format')
 
-        # try:
+        quantities = []
+        for item in items:
+            try:
+                quantities.append(int(item.get('quantity')))
+            except (TypeError, ValueError):
+                return ResponseBadRequest(message='wrong quantity')
+        if min(quantities) < 1:
+            return ResponseBadRequest(message='wrong quantity')
+
         basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
         result = {
             'update_successful': [],
             'not_found': [],
         }
 
-        for item in items:
-            order_item = OrderItem.objects.filter(order_id=basket.id, id=item['id'])
+        # all basket lines of the request in one query, quantities saved by one UPDATE
+        ids = [str(item.get('id')) for item in items]
+        ordered_items = {str(order_item.id): order_item for order_item in OrderItem.objects.filter(
+            order_id=basket.id, id__in=[pk for pk in ids if pk.isdigit()]).only('id', 'quantity')}
+        for pk, item, quantity in zip(ids, items, quantities):
+            order_item = ordered_items.get(pk)
             if order_item:
-                order_item.update(quantity=item['quantity'])
+                order_item.quantity = quantity
                 result['update_successful'].append(item['id'])
             else:
-                result['not_found'].append(item['id'])
-
-        # except Exception:
-        #     ResponseBadRequest(message='invalid request format.')
+                result['not_found'].append(item.get('id'))
+        try:
+            with transaction.atomic():
+                OrderItem.objects.bulk_update(ordered_items.values(), ('quantity',))
+                # holds follow the new quantities
+                release(StockReservation.objects.filter(order_item__in=ordered_items.values()))
+                reserve(ordered_items.values())
+        except IntegrityError:
+            return ResponseBadRequest(message='wrong quantity')
 
         return ResponseOK(result=result)
 
@@ -245,53 +330,45 @@ class BasketViewSet(viewsets.GenericViewSet):
         items_list = items_string.split(',')
         items_list = [item.replace(' ', '') for item in items_list]
 
-        basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
-        query = Q()
         for order_item_id in items_list:
             if not order_item_id.isdigit():
                 return ResponseBadRequest(message='wrong data', data=order_item_id)
-            query = query | Q(order_id=basket.id, id=order_item_id)
-        try:
-            OrderItem.objects.filter(query).delete()
-        except ValueError as e:
-            return ResponseBadRequest(message=e)
+
+        basket, _ = Order.objects.get_or_create(user_id=request.user.id, state='basket')
+        with transaction.atomic():
+            release(StockReservation.objects.filter(order_item__order_id=basket.id, order_item_id__in=items_list))
+            OrderItem.objects.filter(order_id=basket.id, id__in=items_list).delete()
         return ResponseOK(message='Ok!')
 
 
-class OrderViewSet(viewsets.ReadOnlyModelViewSet):
+class OrderViewSet(ConditionalGetMixin, FastSerializerMixin, viewsets.ReadOnlyModelViewSet):
     """
     work with orders - list my orders
     """
 
     permission_classes = (IsAuthenticated,)
     serializer_class = OrderSerializer
+    fast_serializer_class = OrderFastSerializer
+    pagination_class = KeysetPagination
+    ordering_fields = ('id', 'dt', 'state', 'summa')
+    ordering = ('-id',)
 
     def get_queryset(self):
-        return Order.objects.filter(
-            user_id=self.request.user.id).exclude(state='basket').prefetch_related(
-            'ordered_items__product_info__shop',
-            'ordered_items__product_info__product__category',
-            'ordered_items__product_info__product_parameters__parameter').select_related('contact').annotate(
-            summa=Sum(F('ordered_items__quantity') * F('ordered_items__product_info__price'),
-                      output_field=DecimalField(max_digits=20, decimal_places=2))).distinct()
+        return Order.objects.filter(user_id=self.request.user.id).exclude(state='basket').with_items().with_total()
 
-    @staticmethod
-    def create(request, *args, **kwargs):
+    def get_etag(self, request):
+        orders = Order.objects.filter(user_id=request.user.id).exclude(state='basket'). \
+            aggregate(updated=Max('updated'), count=Count('id'))
+        return make_etag(request, request.user.id, orders['updated'], orders['count'])
+
+    @idempotent_response
+    def create(self, request, *args, **kwargs):
         serializer = CreateOrderSerializer(data=request.data, context={'request': request})
         serializer.is_valid(raise_exception=True)
-        data = serializer.validated_data
-        user_id = request.user.id
-
-        try:
-            order = Order.objects.get(user_id=user_id, state='basket')
-        except Order.DoesNotExist:
-            return ResponseBadRequest(message='basket is empty')
-
         try:
-            updated = Order.objects.filter(user_id=user_id, id=order.id).update(contact_id=data['contact'], state='new')
-        except IntegrityError:
-            return ResponseBadRequest(message='wrong arguments')
-        else:
-            if updated:
-                send_mail_order_accepted(order_id=order.id, user_name=request.user, user_email=request.user.email)
+            order = checkout_basket(request.user, serializer.validated_data['contact'])
+        except CheckoutError as e:
+            return ResponseBadRequest(message=e.message, **e.details)
+        # the order accepted email is queued by the checkout, it is sent by a worker once the order is committed
+        transaction.on_commit(dispatch_notifications)
         return ResponseOK(message='Ok!')